@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from threading import Lock, RLock, Thread
+from time import monotonic
+
+
+class TTLCache:
+    """
+    bounded in-process LRU cache whose entries expire after ttl seconds
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def get(self, key, default=None):
+        """ return cached value for key, or default if missing/expired """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """ like get, without touching counters or recency """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= monotonic():
+                return default
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """ store value under key, evicting least recently used entries """
+        if self.maxsize <= 0:
+            return
+        expires_at = monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """ drop key from cache if present """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """ drop every entry and reset counters """
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """ return cache counters as a dictionary """
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class StaleWhileRevalidateCache:
+    """
+    cache that serves entries past their freshness ttl for a further
+    stale window while a background thread reloads them
+    """
+
+    def __init__(self, maxsize=1024, ttl=600.0, stale_ttl=1800.0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refreshes = 0
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl + stale_ttl)
+        self._refreshing = set()
+        self._lock = Lock()
+
+    def get_entry(self, key):
+        """ return (value, stale) for key, or None if it is not cached """
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        value, fresh_until = entry
+        return value, fresh_until <= monotonic()
+
+    def fresh_for(self, key):
+        """ seconds until key goes stale, or None if it is not cached """
+        entry = self._cache.peek(key)
+        if entry is None:
+            return None
+        return entry[1] - monotonic()
+
+    def set(self, key, value):
+        """ store a freshly loaded value under key """
+        self._cache.set(key, (value, monotonic() + self.ttl))
+
+    def begin_refresh(self, key):
+        """ claim the refresh of key, returning False if already claimed """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self.refreshes += 1
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def get_or_load(self, key, loader):
+        """
+        return value for key, calling loader() inline on a miss and in the
+        background when the cached value is stale
+        """
+        entry = self.get_entry(key)
+        if entry is None:
+            value = loader()
+            self.set(key, value)
+            return value
+        value, stale = entry
+        if stale and self.begin_refresh(key):
+            Thread(target=self._refresh, args=(key, loader),
+                   daemon=True).start()
+        return value
+
+    def _refresh(self, key, loader):
+        try:
+            self.set(key, loader())
+        except Exception:
+            # keep serving the stale value until it ages out
+            pass
+        finally:
+            self.end_refresh(key)
+
+    def clear(self):
+        """ drop every entry and reset counters """
+        self._cache.clear()
+        self.refreshes = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def stats(self):
+        """ return cache counters as a dictionary """
+        stats = self._cache.stats()
+        stats.update(ttl=self.ttl, stale_ttl=self.stale_ttl,
+                     refreshes=self.refreshes)
+        return stats
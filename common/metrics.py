@@ -0,0 +1,178 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# per-request phase timings and counts, None outside an instrumented request;
+# worker threads given a copy of the request's context add to the same dicts
+_request = ContextVar('metrics_request', default=None)
+_request_lock = Lock()
+
+
+class Histogram:
+    """ cumulative bucketed histogram for a single label set """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """ histograms by metric name and labels, rendered as Prometheus text """
+
+    def __init__(self):
+        self._metrics = {}
+        self._help = {}
+        self._lock = Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def observe(self, name, labels, value, buckets=DEFAULT_BUCKETS):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._metrics.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._metrics.items()):
+                lines.append(f'# HELP {name} {self._help.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in sorted(series.items()):
+                    total = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',),
+                                            histogram.counts):
+                        total += count
+                        labels = _labels(key + (('le', bound),))
+                        lines.append(f'{name}_bucket{labels} {total}')
+                    labels = _labels(key)
+                    lines.append(f'{name}_sum{labels} {histogram.sum}')
+                    lines.append(f'{name}_count{labels} {total}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+def _labels(pairs):
+    def escape(value):
+        return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+                .replace('\n', '\\n'))
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+
+registry = Registry()
+registry.describe('http_request_duration_seconds',
+                  'Time spent serving a request')
+registry.describe('http_request_phase_seconds',
+                  'Time spent in each phase of a request')
+registry.describe('http_request_phase_operations',
+                  'Operations performed in each phase of a request')
+
+
+def add(phase, seconds, count=1):
+    """ charge seconds and count operations to phase of the current request """
+    state = _request.get()
+    if state is not None:
+        timings, counts = state
+        with _request_lock:
+            timings[phase] = timings.get(phase, 0.0) + seconds
+            counts[phase] = counts.get(phase, 0) + count
+
+
+@contextmanager
+def timed(phase):
+    """ time the enclosed block as phase of the current request """
+    if _request.get() is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        add(phase, perf_counter() - start)
+
+
+def instrument_engine(engine, phase='db'):
+    """ time every statement run on engine as phase """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        add(phase, perf_counter() - conn.info['metrics_start'].pop())
+
+    @event.listens_for(engine, 'handle_error')
+    def error(context):
+        conn = context.connection
+        starts = conn.info.get('metrics_start') if conn is not None else None
+        if starts:
+            add(phase, perf_counter() - starts.pop())
+
+
+def init_app(app, phases=()):
+    """
+    record per-route latency and phase breakdowns for a Flask app and
+    serve them at /metrics; phases listed are reported even when a
+    request spends no time in them
+    """
+    from flask import request, g
+
+    json_response = app.json.response
+
+    def timed_json_response(*args, **kwargs):
+        with timed('serialize'):
+            return json_response(*args, **kwargs)
+
+    app.json.response = timed_json_response
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = perf_counter()
+        g.metrics_token = _request.set(({}, {}))
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        token = g.pop('metrics_token', None)
+        if start is None:
+            return response
+        elapsed = perf_counter() - start
+        timings, counts = _request.get()
+        _request.reset(token)
+
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        registry.observe('http_request_duration_seconds',
+                         {'route': route, 'method': request.method,
+                          'status': response.status_code}, elapsed)
+        for phase in set(phases) | set(timings):
+            labels = {'route': route, 'phase': phase}
+            registry.observe('http_request_phase_seconds', labels,
+                             timings.get(phase, 0.0))
+            registry.observe('http_request_phase_operations', labels,
+                             counts.get(phase, 0), buckets=COUNT_BUCKETS)
+        return response
+
+    @app.get('/metrics')
+    def metrics():
+        return app.response_class(
+            registry.render(), content_type='text/plain; version=0.0.4')
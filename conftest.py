@@ -0,0 +1,53 @@
+"""
+each app imports its own modules by their bare names (app, cache, ...),
+which clash between the two apps; before collecting or running a spec,
+make its app's modules the importable ones and park the other app's
+"""
+from pathlib import Path
+import sys
+import pytest
+
+ROOT = Path(__file__).parent
+APP_DIRS = [ROOT / 'stage_one_task', ROOT / 'stage_two_task']
+
+# specs may import the shared common package before any app module
+sys.path.append(str(ROOT))
+
+# modules of the apps not currently active, by app directory
+_parked = {app_dir: {} for app_dir in APP_DIRS}
+_active = None
+
+
+def _app_dir(path):
+    path = Path(path)
+    return next((app_dir for app_dir in APP_DIRS
+                 if app_dir == path or app_dir in path.parents), None)
+
+
+def activate(path):
+    """ make the app containing path the one whose modules import """
+    global _active
+    app_dir = _app_dir(path)
+    if app_dir is None or app_dir == _active:
+        return
+    for name, module in list(sys.modules.items()):
+        owner = _app_dir(getattr(module, '__file__', None) or ROOT)
+        if owner is not None and owner != app_dir:
+            _parked[owner][name] = sys.modules.pop(name)
+    sys.modules.update(_parked[app_dir])
+    _parked[app_dir].clear()
+    sys.path[:] = [entry for entry in sys.path
+                   if Path(entry).resolve() not in APP_DIRS]
+    sys.path.insert(0, str(app_dir))
+    _active = app_dir
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_make_collect_report(collector):
+    activate(collector.path)
+    yield
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_setup(item):
+    activate(item.path)
@@ -0,0 +1,225 @@
+import asyncio
+from urllib.parse import urlsplit
+import aiohttp
+from aiohttp import web
+from upstream import CircuitBreaker, CircuitOpen
+from singleflight import AsyncSingleFlight
+from app import (
+    GEOLOCATION_API_URL,
+    WEATHER_API_URL,
+    WEATHER_API_KEY,
+    UPSTREAM_POOL_SIZE,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    UPSTREAM_RETRIES,
+    UPSTREAM_BACKOFF,
+    UPSTREAM_FAILURE_THRESHOLD,
+    UPSTREAM_RESET_TIMEOUT,
+    geoip_db,
+    geo_cache,
+    weather_cache,
+    weather_sketch,
+    geo_cache_key,
+    weather_cell,
+    build_greeting,
+)
+
+GEO_URL = web.AppKey('geo_url', str)
+WEATHER_URL = web.AppKey('weather_url', str)
+UPSTREAM = web.AppKey('upstream', object)
+
+# coalesces concurrent identical upstream lookups
+upstream_flight = AsyncSingleFlight()
+
+# strong references to in-flight background refreshes
+_refresh_tasks = set()
+
+
+class AsyncUpstreamClient:
+    """
+    non-blocking counterpart of upstream.UpstreamClient built on a shared
+    aiohttp session
+    """
+
+    def __init__(self, pool_size=UPSTREAM_POOL_SIZE,
+                 connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+                 read_timeout=UPSTREAM_READ_TIMEOUT,
+                 retries=UPSTREAM_RETRIES, backoff=UPSTREAM_BACKOFF,
+                 failure_threshold=UPSTREAM_FAILURE_THRESHOLD,
+                 reset_timeout=UPSTREAM_RESET_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                             sock_read=read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.session = None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def breaker(self, url):
+        """ return the circuit breaker guarding url's host """
+        host = urlsplit(url).netloc
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold,
+                                     self.reset_timeout)
+            self.breakers[host] = breaker
+        return breaker
+
+    async def get_json(self, url, params=None):
+        """
+        GET url and return the decoded JSON body, raising
+        aiohttp.ClientError (or CircuitOpen) on failure
+        """
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise CircuitOpen(f'circuit open for {urlsplit(url).netloc}')
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * (2 ** (attempt - 1)))
+            try:
+                async with self.session.get(url, params=params) as response:
+                    if response.status < 500:
+                        # a 4xx still means the upstream is up
+                        breaker.record_success()
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+                    error = f'status {response.status}'
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = repr(e)
+        breaker.record_failure()
+        raise aiohttp.ClientError(f'GET {url} failed: {error}')
+
+
+async def lookup_location(upstream, client_ip, geo_url=GEOLOCATION_API_URL):
+    """ asyncio counterpart of app.lookup_location """
+    if geoip_db is not None:
+        geo_data = geoip_db.lookup(client_ip)
+        if geo_data is not None:
+            return geo_data
+    key = geo_cache_key(client_ip)
+    geo_data = geo_cache.get(key)
+    if geo_data is None:
+        try:
+            geo_data = await upstream_flight.do(
+                ('geo', key),
+                lambda: fetch_location(upstream, client_ip, key, geo_url))
+        except (aiohttp.ClientError, CircuitOpen, ValueError):
+            return {}
+    return geo_data
+
+
+async def fetch_location(upstream, client_ip, key, geo_url=GEOLOCATION_API_URL):
+    """ query the geolocation service for client_ip and cache it under key """
+    geo_data = await upstream.get_json(geo_url + client_ip)
+    geo_cache.set(key, geo_data)
+    return geo_data
+
+
+async def fetch_temperature(upstream, lat, lon, weather_url=WEATHER_API_URL):
+    """ query the weather service for the temperature at lat, lon """
+    weather_data = await upstream.get_json(weather_url, params={
+        'lat': lat,
+        'lon': lon,
+        'appid': WEATHER_API_KEY or '',
+        'units': 'metric'
+    })
+    return weather_data.get('main', {}).get('temp', 'N/A')
+
+
+async def _load_temperature(upstream, cell, weather_url):
+    temperature = await fetch_temperature(upstream, *cell, weather_url)
+    weather_cache.set(cell, temperature)
+    return temperature
+
+
+async def _refresh_temperature(upstream, cell, weather_url):
+    try:
+        await _load_temperature(upstream, cell, weather_url)
+    except (aiohttp.ClientError, CircuitOpen, ValueError):
+        # keep serving the stale value until it ages out
+        pass
+    finally:
+        weather_cache.end_refresh(cell)
+
+
+async def lookup_temperature(upstream, lat, lon, weather_url=WEATHER_API_URL):
+    """ return temperature for the grid cell holding lat, lon """
+    cell = weather_cell(lat, lon)
+    weather_sketch.add(cell)
+    entry = weather_cache.get_entry(cell)
+    if entry is None:
+        try:
+            return await upstream_flight.do(
+                ('weather', cell),
+                lambda: _load_temperature(upstream, cell, weather_url))
+        except (aiohttp.ClientError, CircuitOpen, ValueError):
+            return 'N/A'
+    temperature, stale = entry
+    if stale and weather_cache.begin_refresh(cell):
+        task = asyncio.get_running_loop().create_task(
+            _refresh_temperature(upstream, cell, weather_url))
+        _refresh_tasks.add(task)
+        task.add_done_callback(_refresh_tasks.discard)
+    return temperature
+
+
+def get_client_ip(request):
+    forwarded = request.headers.getall('X-Forwarded-For', [])
+    if forwarded:
+        return forwarded[0]
+    return request.remote
+
+
+async def get_location(request):
+    """ asyncio counterpart of app.get_location """
+    app = request.app
+    upstream = app[UPSTREAM]
+    client_ip = get_client_ip(request)
+    geo_data = await lookup_location(upstream, client_ip, app[GEO_URL])
+
+    visitor_name = request.query.get('visitor_name', '<No Name>')
+
+    lat = geo_data.get('lat')
+    lon = geo_data.get('lon')
+    if lat and lon:
+        temperature = await lookup_temperature(upstream, lat, lon,
+                                               app[WEATHER_URL])
+    else:
+        temperature = 'N/A'
+
+    return web.json_response(build_greeting(client_ip, visitor_name,
+                                            geo_data, temperature))
+
+
+def create_app(geo_url=GEOLOCATION_API_URL, weather_url=WEATHER_API_URL,
+               upstream=None):
+    """ build the aiohttp application serving /api/hello """
+    app = web.Application()
+    app[GEO_URL] = geo_url
+    app[WEATHER_URL] = weather_url
+    app[UPSTREAM] = upstream or AsyncUpstreamClient()
+
+    async def upstream_ctx(app):
+        await app[UPSTREAM].start()
+        yield
+        await app[UPSTREAM].close()
+
+    app.cleanup_ctx.append(upstream_ctx)
+    app.router.add_get('/api/hello', get_location)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), port=5000)
@@ -1,15 +1,86 @@
 from flask import Flask, request, jsonify
 import requests
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from dotenv import load_dotenv
 from os import getenv
+import os
+import sys
+
+# the common package, shared by both apps, lives at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.cache import TTLCache, StaleWhileRevalidateCache  # noqa: E402
+from common import metrics  # noqa: E402
+from upstream import UpstreamClient  # noqa: E402
+from geoip import GeoIPDatabase  # noqa: E402
+from singleflight import SingleFlight  # noqa: E402
+from prewarm import SpaceSaving, WeatherPrewarmer  # noqa: E402
+
+load_dotenv()
 
 app = Flask(__name__)
 
+# per-route latency histograms at /metrics
+if getenv('METRICS_ENABLED', '1') == '1':
+    metrics.init_app(app, phases=('geolocation', 'weather', 'serialize'))
+
 GEOLOCATION_API_URL = getenv('GEOLOCATION_API_URL')
 WEATHER_API_URL = getenv('WEATHER_API_URL')
 WEATHER_API_KEY = getenv('WEATHER_API_KEY')
 
-load_dotenv()
+# optional offline geolocation database built with geoip.py
+GEOIP_DB_PATH = getenv('GEOIP_DB_PATH')
+
+# geolocation cache settings, prefix lengths of 0 cache per exact address
+GEO_CACHE_SIZE = int(getenv('GEO_CACHE_SIZE', 4096))
+GEO_CACHE_TTL = float(getenv('GEO_CACHE_TTL', 3600))
+GEO_CACHE_PREFIX_V4 = int(getenv('GEO_CACHE_PREFIX_V4', 0))
+GEO_CACHE_PREFIX_V6 = int(getenv('GEO_CACHE_PREFIX_V6', 0))
+
+# weather cache settings, coordinates are snapped to a grid of this many degrees
+WEATHER_GRID = float(getenv('WEATHER_GRID', 0.1))
+WEATHER_CACHE_SIZE = int(getenv('WEATHER_CACHE_SIZE', 4096))
+WEATHER_CACHE_TTL = float(getenv('WEATHER_CACHE_TTL', 600))
+WEATHER_CACHE_STALE_TTL = float(getenv('WEATHER_CACHE_STALE_TTL', 1800))
+
+# shared upstream client settings
+UPSTREAM_POOL_SIZE = int(getenv('UPSTREAM_POOL_SIZE', 20))
+UPSTREAM_CONNECT_TIMEOUT = float(getenv('UPSTREAM_CONNECT_TIMEOUT', 2))
+UPSTREAM_READ_TIMEOUT = float(getenv('UPSTREAM_READ_TIMEOUT', 5))
+UPSTREAM_RETRIES = int(getenv('UPSTREAM_RETRIES', 2))
+UPSTREAM_BACKOFF = float(getenv('UPSTREAM_BACKOFF', 0.2))
+UPSTREAM_FAILURE_THRESHOLD = int(getenv('UPSTREAM_FAILURE_THRESHOLD', 5))
+UPSTREAM_RESET_TIMEOUT = float(getenv('UPSTREAM_RESET_TIMEOUT', 30))
+
+# weather pre-warming settings, a budget of 0 disables the pre-warmer
+WEATHER_PREWARM_BUDGET = int(getenv('WEATHER_PREWARM_BUDGET', 0))
+WEATHER_PREWARM_TOP = int(getenv('WEATHER_PREWARM_TOP', 50))
+WEATHER_PREWARM_LEAD_TIME = float(getenv('WEATHER_PREWARM_LEAD_TIME', 60))
+
+# batch greeting settings
+BATCH_MAX_SIZE = int(getenv('BATCH_MAX_SIZE', 1000))
+BATCH_CONCURRENCY = int(getenv('BATCH_CONCURRENCY', 16))
+
+upstream = UpstreamClient(pool_size=UPSTREAM_POOL_SIZE,
+                          connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+                          read_timeout=UPSTREAM_READ_TIMEOUT,
+                          retries=UPSTREAM_RETRIES,
+                          backoff=UPSTREAM_BACKOFF,
+                          failure_threshold=UPSTREAM_FAILURE_THRESHOLD,
+                          reset_timeout=UPSTREAM_RESET_TIMEOUT)
+geoip_db = GeoIPDatabase.open(GEOIP_DB_PATH) if GEOIP_DB_PATH else None
+geo_cache = TTLCache(maxsize=GEO_CACHE_SIZE, ttl=GEO_CACHE_TTL)
+weather_cache = StaleWhileRevalidateCache(maxsize=WEATHER_CACHE_SIZE,
+                                          ttl=WEATHER_CACHE_TTL,
+                                          stale_ttl=WEATHER_CACHE_STALE_TTL)
+# most requested weather cells, fed to the pre-warmer
+weather_sketch = SpaceSaving(capacity=max(WEATHER_PREWARM_TOP * 4, 64))
+# coalesces concurrent identical upstream lookups
+upstream_flight = SingleFlight()
+# caps the number of upstream lookups a batch runs at once
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
 
 
 def get_client_ip():
@@ -20,48 +91,192 @@ def get_client_ip():
     return ip
 
 
-@app.route('/api/hello', methods=['GET'])
-def get_location():
+def geo_cache_key(ip):
+    """ cache key for ip, collapsed to its network when a prefix is set """
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    prefix = GEO_CACHE_PREFIX_V4 if address.version == 4 else GEO_CACHE_PREFIX_V6
+    if not prefix:
+        return str(address)
+    return str(ipaddress.ip_network(f'{address}/{prefix}', strict=False))
 
-    client_ip = get_client_ip()
-    # Use geolocation service to get location data
-    response = requests.get(GEOLOCATION_API_URL + client_ip)
-    geo_data = response.json()
 
-    # Extract relevant data
-    city = geo_data.get('city', 'Unknown')
-    visitor_name = request.args.get('visitor_name', '<No Name>')
+def lookup_location(client_ip):
+    """
+    return geolocation data for client_ip from the offline database, or
+    from the remote service (cached) when the database has no match
+    """
+    if geoip_db is not None:
+        geo_data = geoip_db.lookup(client_ip)
+        if geo_data is not None:
+            return geo_data
+    key = geo_cache_key(client_ip)
+    geo_data = geo_cache.get(key)
+    if geo_data is None:
+        try:
+            geo_data = upstream_flight.do(('geo', key),
+                                          lambda: fetch_location(client_ip, key))
+        except requests.RequestException:
+            return {}
+    return geo_data
 
-    # get coordinates for weather retrieval
-    city = geo_data.get('city', 'Unknown')
-    lat = geo_data.get('lat')
-    lon = geo_data.get('lon')
 
-    # Use weather service to get weather data
-    if lat and lon:
-        weather_response = requests.get(WEATHER_API_URL, params={
+def fetch_location(client_ip, key):
+    """ query the geolocation service for client_ip and cache it under key """
+    with metrics.timed('geolocation'):
+        geo_data = upstream.get_json(GEOLOCATION_API_URL + client_ip)
+    geo_cache.set(key, geo_data)
+    return geo_data
+
+
+def weather_cell(lat, lon):
+    """ snap coordinates to the centre of their weather grid cell """
+    if WEATHER_GRID <= 0:
+        return float(lat), float(lon)
+    return (round(round(float(lat) / WEATHER_GRID) * WEATHER_GRID, 6),
+            round(round(float(lon) / WEATHER_GRID) * WEATHER_GRID, 6))
+
+
+def fetch_temperature(lat, lon):
+    """ query the weather service for the temperature at lat, lon """
+    with metrics.timed('weather'):
+        weather_data = upstream.get_json(WEATHER_API_URL, params={
             'lat': lat,
             'lon': lon,
             'appid': WEATHER_API_KEY,
             'units': 'metric'
         })
-        weather_data = weather_response.json()
-        temperature = weather_data.get('main', {}).get('temp', 'N/A')
-    else:
-        temperature = 'N/A'
+    return weather_data.get('main', {}).get('temp', 'N/A')
+
+
+def lookup_temperature(lat, lon):
+    """ return temperature for the grid cell holding lat, lon """
+    cell = weather_cell(lat, lon)
+    weather_sketch.add(cell)
+    try:
+        return weather_cache.get_or_load(cell, lambda: upstream_flight.do(
+            ('weather', cell), lambda: fetch_temperature(*cell)))
+    except requests.RequestException:
+        return 'N/A'
+
+
+weather_prewarmer = WeatherPrewarmer(
+    weather_cache,
+    lambda cell: upstream_flight.do(('weather', cell),
+                                    lambda: fetch_temperature(*cell)),
+    weather_sketch,
+    budget_per_minute=WEATHER_PREWARM_BUDGET,
+    top=WEATHER_PREWARM_TOP,
+    lead_time=WEATHER_PREWARM_LEAD_TIME)
+if WEATHER_PREWARM_BUDGET > 0:
+    weather_prewarmer.start()
+
+
+def build_greeting(client_ip, visitor_name, geo_data, temperature):
+    """ build the /api/hello response body """
+    city = geo_data.get('city', 'Unknown')
 
     # Generate greeting message
     greeting = f"Hello, {visitor_name}!, the temperature is {temperature} degrees Celcius in {city}"
 
     # Prepare response
-    response_data = {
+    return {
         "client_ip": client_ip,
         "location": city,
         "greeting": greeting
     }
 
+
+@app.route('/api/hello', methods=['GET'])
+def get_location():
+
+    client_ip = get_client_ip()
+    # Use geolocation service to get location data
+    geo_data = lookup_location(client_ip)
+
+    visitor_name = request.args.get('visitor_name', '<No Name>')
+
+    # get coordinates for weather retrieval
+    lat = geo_data.get('lat')
+    lon = geo_data.get('lon')
+
+    # Use weather service to get weather data
+    if lat and lon:
+        temperature = lookup_temperature(lat, lon)
+    else:
+        temperature = 'N/A'
+
+    response_data = build_greeting(client_ip, visitor_name, geo_data,
+                                   temperature)
+
     return jsonify(response_data)
 
 
+def map_in_context(fn, items):
+    """
+    like batch_executor.map, running each call in a copy of the request's
+    context so the time it spends is charged to the request's phases
+    """
+    futures = [batch_executor.submit(copy_context().run, fn, item)
+               for item in items]
+    return [future.result() for future in futures]
+
+
+@app.post('/api/hello/batch')
+def get_locations():
+    """ greet many visitors at once, looking up each ip and weather cell once """
+    visitors = (request.get_json(silent=True) or {}).get('visitors')
+    if not isinstance(visitors, list):
+        return jsonify(errors=[{'field': 'visitors',
+                                'message': 'visitors must be a list'}]), 422
+    if len(visitors) > BATCH_MAX_SIZE:
+        return jsonify(errors=[{
+            'field': 'visitors',
+            'message': f'at most {BATCH_MAX_SIZE} visitors per request'
+        }]), 422
+    if not all(isinstance(visitor, dict) for visitor in visitors):
+        return jsonify(errors=[{'field': 'visitors',
+                                'message': 'each visitor must be an object'}]), 422
+
+    # visitors without an ip are the caller
+    default_ip = get_client_ip()
+    client_ips = [visitor.get('ip', default_ip) for visitor in visitors]
+    if not all(isinstance(ip, str) and ip for ip in client_ips):
+        return jsonify(errors=[{'field': 'ip',
+                                'message': 'ip must be a non-empty string'}]), 422
+
+    # one geolocation lookup per distinct ip
+    unique_ips = list(dict.fromkeys(client_ips))
+    locations = dict(zip(unique_ips,
+                         map_in_context(lookup_location, unique_ips)))
+
+    # one weather lookup per distinct grid cell
+    cells = {}
+    for geo_data in locations.values():
+        lat = geo_data.get('lat')
+        lon = geo_data.get('lon')
+        if lat and lon:
+            cells[weather_cell(lat, lon)] = None
+    temperatures = dict(zip(cells, map_in_context(
+        lambda cell: lookup_temperature(*cell), cells)))
+
+    results = []
+    for visitor, client_ip in zip(visitors, client_ips):
+        geo_data = locations[client_ip]
+        lat = geo_data.get('lat')
+        lon = geo_data.get('lon')
+        if lat and lon:
+            temperature = temperatures[weather_cell(lat, lon)]
+        else:
+            temperature = 'N/A'
+        results.append(build_greeting(
+            client_ip, visitor.get('visitor_name', '<No Name>'), geo_data,
+            temperature))
+
+    return jsonify(results=results)
+
+
 if __name__ == '__main__':
     app.run(debug=True)
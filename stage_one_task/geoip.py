@@ -0,0 +1,193 @@
+"""
+offline IPv4 range to location database
+
+The converter turns a CSV of ranges into a compact binary file laid out as
+
+    header      magic, range count, locations blob length
+    starts      uint32 per range, sorted ascending, ranges disjoint
+    ends        uint32 per range
+    locations   uint32 index into the locations table per range
+    table       JSON list of [city, lat, lon]
+
+which is memory-mapped at load time, so every worker process serving
+from the same file shares one copy of the page cache.
+
+usage: python geoip.py ranges.csv geoip.bin
+"""
+from array import array
+from bisect import bisect_right
+from heapq import heappush, heappop
+import csv
+import ipaddress
+import json
+import math
+import mmap
+import struct
+import sys
+
+MAGIC = b'HNGGEO1\0'
+HEADER = struct.Struct('<8sII')
+
+
+def _parse_range(row):
+    """
+    return (start, end, (city, lat, lon)) for a csv row, or None for
+    header lines, IPv6 ranges, short rows and unparseable coordinates
+    """
+    try:
+        if '/' in row[0]:
+            network = ipaddress.ip_network(row[0].strip(), strict=False)
+            start, end, rest = (network.network_address,
+                                network.broadcast_address, row[1:])
+        else:
+            start = ipaddress.ip_address(row[0].strip())
+            end = ipaddress.ip_address(row[1].strip())
+            rest = row[2:]
+        city, lat, lon = rest[0], float(rest[1]), float(rest[2])
+    except (ValueError, IndexError):
+        return None
+    if (start.version != 4 or end.version != 4 or start > end
+            or not (math.isfinite(lat) and math.isfinite(lon))):
+        return None
+    return int(start), int(end), (city, lat, lon)
+
+
+def _flatten(ranges):
+    """
+    split (start, end, row, location) ranges that nest or overlap into
+    disjoint (start, end, location) ranges, sorted by start; each address
+    takes the location of the narrowest range covering it, the later row
+    on ties, as a more specific block overrides the one it sits in
+    """
+    ranges.sort()
+    bounds = sorted({r[0] for r in ranges} | {r[1] + 1 for r in ranges})
+    flat = []
+    # ranges covering the current segment, narrowest first
+    active = []
+    i = 0
+    for start, next_bound in zip(bounds, bounds[1:]):
+        while i < len(ranges) and ranges[i][0] <= start:
+            range_start, range_end, row, location = ranges[i]
+            heappush(active, (range_end - range_start, -row, range_end,
+                              location))
+            i += 1
+        while active and active[0][2] < start:
+            heappop(active)
+        if not active:
+            continue
+        location = active[0][3]
+        if flat and flat[-1][1] == start - 1 and flat[-1][2] == location:
+            flat[-1] = (flat[-1][0], next_bound - 1, location)
+        else:
+            flat.append((start, next_bound - 1, location))
+    return flat
+
+
+def convert(csv_path, out_path):
+    """
+    convert a CSV of ``start_ip,end_ip,city,lat,lon`` or
+    ``cidr,city,lat,lon`` rows into the binary format read by
+    GeoIPDatabase, returning the number of ranges written; rows that
+    can't be parsed are skipped and overlapping ranges are flattened
+    """
+    ranges = []
+    table = []
+    table_index = {}
+    with open(csv_path, newline='') as f:
+        for row_number, row in enumerate(csv.reader(f)):
+            parsed = _parse_range(row) if row else None
+            if parsed is None:
+                # header line, IPv6 range or bad row
+                continue
+            start, end, location = parsed
+            if location not in table_index:
+                table_index[location] = len(table)
+                table.append(location)
+            ranges.append((start, end, row_number, table_index[location]))
+
+    ranges = _flatten(ranges)
+    starts = array('I', (r[0] for r in ranges))
+    ends = array('I', (r[1] for r in ranges))
+    locations = array('I', (r[2] for r in ranges))
+    if sys.byteorder != 'little':
+        for column in (starts, ends, locations):
+            column.byteswap()
+    blob = json.dumps(table, separators=(',', ':')).encode('utf-8')
+
+    with open(out_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(ranges), len(blob)))
+        starts.tofile(f)
+        ends.tofile(f)
+        locations.tofile(f)
+        f.write(blob)
+    return len(ranges)
+
+
+class GeoIPDatabase:
+    """
+    read-only view over a file written by convert(), answering lookups
+    by binary search over the sorted range starts
+    """
+
+    def __init__(self, buffer):
+        magic, count, blob_length = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('not a geoip database file')
+        self._buffer = buffer
+        self._view = view = memoryview(buffer)
+        offset = HEADER.size
+        columns = []
+        for _ in range(3):
+            column = view[offset:offset + count * 4]
+            if sys.byteorder == 'little':
+                column = column.cast('I')
+            else:
+                column = array('I', column.tobytes())
+                column.byteswap()
+            columns.append(column)
+            offset += count * 4
+        self._starts, self._ends, self._locations = columns
+        table = json.loads(bytes(view[offset:offset + blob_length]))
+        self._table = [{'city': city, 'lat': lat, 'lon': lon}
+                       for city, lat, lon in table]
+
+    @classmethod
+    def open(cls, path):
+        """ memory-map the database at path """
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def lookup(self, ip):
+        """
+        return geolocation data for ip in the shape the remote service
+        uses, or None when no range covers it
+        """
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version != 4:
+            return None
+        value = int(address)
+        i = bisect_right(self._starts, value) - 1
+        if i < 0 or value > self._ends[i]:
+            return None
+        return dict(self._table[self._locations[i]])
+
+    def close(self):
+        for column in (self._starts, self._ends, self._locations):
+            if isinstance(column, memoryview):
+                column.release()
+        self._view.release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(__doc__.rstrip().rsplit('\n', 1)[-1])
+    print(f'wrote {convert(sys.argv[1], sys.argv[2])} ranges to {sys.argv[2]}')
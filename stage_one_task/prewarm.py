@@ -0,0 +1,134 @@
+from threading import Event, Lock, Thread
+from time import monotonic
+
+
+class SpaceSaving:
+    """
+    heavy-hitters sketch tracking approximate counts for at most
+    capacity keys, replacing the least counted key when full; keys are
+    grouped in buckets by count with the lowest count tracked, so add
+    never scans the counters
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._counts = {}
+        # count -> keys with that count, oldest first
+        self._buckets = {}
+        self._min = 0
+        self._lock = Lock()
+
+    def add(self, key):
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._move(key, count, count + 1)
+            elif len(self._counts) < self.capacity:
+                self._counts[key] = 1
+                self._buckets.setdefault(1, {})[key] = None
+                self._min = 1
+            else:
+                # the new key inherits the evicted count, as an upper bound
+                victim = next(iter(self._buckets[self._min]))
+                del self._counts[victim]
+                self._move(key, self._min, self._min + 1, replaces=victim)
+
+    def _move(self, key, count, new_count, replaces=None):
+        bucket = self._buckets[count]
+        del bucket[replaces if replaces is not None else key]
+        if not bucket:
+            del self._buckets[count]
+            if self._min == count:
+                self._min = new_count
+        self._counts[key] = new_count
+        self._buckets.setdefault(new_count, {})[key] = None
+
+    def top(self, n):
+        """ return the n most counted keys, most counted first """
+        with self._lock:
+            return sorted(self._counts, key=self._counts.get,
+                          reverse=True)[:n]
+
+    def decay(self):
+        """ halve every count so stale popularity fades out """
+        with self._lock:
+            self._counts = {key: count // 2
+                            for key, count in self._counts.items()
+                            if count > 1}
+            self._buckets = {}
+            for key, count in self._counts.items():
+                self._buckets.setdefault(count, {})[key] = None
+            self._min = min(self._buckets, default=0)
+
+    def __len__(self):
+        return len(self._counts)
+
+
+class WeatherPrewarmer:
+    """
+    background thread that reloads the hottest weather cells shortly
+    before they go stale, spending at most budget_per_minute upstream
+    calls per minute
+    """
+
+    def __init__(self, cache, loader, sketch, budget_per_minute=60,
+                 top=50, lead_time=60.0, interval=5.0):
+        self.cache = cache
+        self.loader = loader
+        self.sketch = sketch
+        self.budget_per_minute = budget_per_minute
+        self.top = top
+        self.lead_time = lead_time
+        self.interval = interval
+        self.refreshed = 0
+        self.failed = 0
+        self._tokens = float(budget_per_minute)
+        self._last_fill = monotonic()
+        self._last_decay = monotonic()
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def _fill(self):
+        now = monotonic()
+        self._tokens = min(self.budget_per_minute,
+                           self._tokens + (now - self._last_fill)
+                           * self.budget_per_minute / 60.0)
+        self._last_fill = now
+        if now - self._last_decay >= 60.0:
+            self.sketch.decay()
+            self._last_decay = now
+
+    def run_once(self):
+        """ refresh due hot cells while the budget allows """
+        self._fill()
+        for cell in self.sketch.top(self.top):
+            if self._tokens < 1:
+                break
+            fresh_for = self.cache.fresh_for(cell)
+            if fresh_for is not None and fresh_for > self.lead_time:
+                continue
+            if not self.cache.begin_refresh(cell):
+                continue
+            self._tokens -= 1
+            try:
+                self.cache.set(cell, self.loader(cell))
+                self.refreshed += 1
+            except Exception:
+                self.failed += 1
+            finally:
+                self.cache.end_refresh(cell)
@@ -0,0 +1,82 @@
+import asyncio
+from concurrent.futures import Future
+from threading import Lock
+
+
+class SingleFlight:
+    """
+    runs at most one call per key at a time; concurrent callers with the
+    same key wait for and share the first caller's result or exception
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._inflight = {}
+        self._lock = Lock()
+
+    def do(self, key, fn):
+        """ return fn(), or the result of an identical call already running """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+# result handed to waiters when the caller running the call is cancelled
+_RETRY = object()
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight for coroutine functions; if the
+    caller running a call is cancelled, its waiters start the call again
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._inflight = {}
+
+    async def do(self, key, coro_fn):
+        """ await coro_fn(), or an identical call already running """
+        while key in self._inflight:
+            self.shared += 1
+            result = await asyncio.shield(self._inflight[key])
+            if result is not _RETRY:
+                return result
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        self.calls += 1
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            # the first waiter to resume takes over the call
+            future.set_result(_RETRY)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # waiters re-raise it themselves; don't log it as unhandled
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
@@ -0,0 +1,99 @@
+import asyncio, os, sys
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aio_app import create_app  # noqa: E402
+from app import geo_cache, weather_cache  # noqa: E402
+
+
+def stub_upstreams(calls):
+    """ local stand-in for the geolocation and weather services """
+    async def geo(request):
+        calls.append(('geo', request.match_info['ip']))
+        if request.match_info['ip'] == '10.0.0.1':
+            return web.json_response({'status': 'fail'})
+        return web.json_response({'city': 'Lagos', 'lat': 6.45, 'lon': 3.39})
+
+    async def weather(request):
+        calls.append(('weather', request.query['lat'], request.query['lon']))
+        return web.json_response({'main': {'temp': 28.5}})
+
+    stub = web.Application()
+    stub.router.add_get('/json/{ip}', geo)
+    stub.router.add_get('/weather', weather)
+    return stub
+
+
+def run(scenario):
+    async def main():
+        geo_cache.clear()
+        weather_cache.clear()
+        calls = []
+        async with TestServer(stub_upstreams(calls)) as stub:
+            app = create_app(geo_url=str(stub.make_url('/json/')),
+                             weather_url=str(stub.make_url('/weather')))
+            async with TestClient(TestServer(app)) as client:
+                return await scenario(client, calls)
+    return asyncio.run(main())
+
+
+def test_hello_contract():
+    async def scenario(client, calls):
+        response = await client.get('/api/hello',
+                                    params={'visitor_name': 'Mark'},
+                                    headers={'X-Forwarded-For': '1.2.3.4'})
+        assert response.status == 200
+        return await response.json()
+
+    data = run(scenario)
+    assert data == {
+        'client_ip': '1.2.3.4',
+        'location': 'Lagos',
+        'greeting': 'Hello, Mark!, the temperature is 28.5 degrees Celcius in Lagos'
+    }
+
+
+def test_unknown_location():
+    async def scenario(client, calls):
+        response = await client.get('/api/hello',
+                                    headers={'X-Forwarded-For': '10.0.0.1'})
+        return await response.json(), calls
+
+    data, calls = run(scenario)
+    assert data['location'] == 'Unknown'
+    assert 'N/A degrees' in data['greeting']
+    assert [c[0] for c in calls] == ['geo']
+
+
+def test_concurrent_requests_hit_cache():
+    async def scenario(client, calls):
+        await client.get('/api/hello', headers={'X-Forwarded-For': '1.2.3.4'})
+        responses = await asyncio.gather(*[
+            client.get('/api/hello', headers={'X-Forwarded-For': '1.2.3.4'})
+            for _ in range(50)])
+        assert all(r.status == 200 for r in responses)
+        return calls
+
+    calls = run(scenario)
+    assert calls.count(('geo', '1.2.3.4')) == 1
+    assert len([c for c in calls if c[0] == 'weather']) == 1
+
+
+def test_concurrent_cold_requests_are_coalesced():
+    async def scenario(client, calls):
+        responses = await asyncio.gather(*[
+            client.get('/api/hello', headers={'X-Forwarded-For': '1.2.3.4'})
+            for _ in range(50)])
+        assert all(r.status == 200 for r in responses)
+        return calls
+
+    calls = run(scenario)
+    assert calls.count(('geo', '1.2.3.4')) == 1
+    assert len([c for c in calls if c[0] == 'weather']) == 1
+
+
+if __name__ == '__main__':
+    pytest.main()
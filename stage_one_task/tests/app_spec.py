@@ -0,0 +1,96 @@
+import os, re, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as hello  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """ /api/hello app with stand-in geolocation and weather services """
+    calls = []
+
+    def get_json(url, params=None):
+        if params is None:
+            calls.append(('geo', url.rsplit('/', 1)[-1]))
+            return {'city': 'Lagos', 'lat': 6.45, 'lon': 3.39}
+        calls.append(('weather', params['lat'], params['lon']))
+        return {'main': {'temp': 28.5}}
+
+    monkeypatch.setattr(hello, 'GEOLOCATION_API_URL', 'http://geo/json/')
+    monkeypatch.setattr(hello, 'WEATHER_API_URL', 'http://weather/')
+    monkeypatch.setattr(hello.upstream, 'get_json', get_json)
+    hello.geo_cache.clear()
+    hello.weather_cache.clear()
+    client = hello.app.test_client()
+    client.calls = calls
+    return client
+
+
+def phase_sum(metrics, name, phase, route):
+    match = re.search(rf'^{name}_sum{{phase="{phase}",route="{route}"}} (\S+)$',
+                      metrics, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_repeat_hello_is_served_from_cache(client):
+    for _ in range(2):
+        response = client.get('/api/hello',
+                              headers={'X-Forwarded-For': '1.2.3.4'})
+        assert response.json['location'] == 'Lagos'
+    assert client.calls == [('geo', '1.2.3.4'), ('weather', 6.4, 3.4)]
+    assert hello.geo_cache.hits == 1
+
+
+def test_prefix_shares_one_lookup_per_network(client, monkeypatch):
+    monkeypatch.setattr(hello, 'GEO_CACHE_PREFIX_V4', 24)
+    for ip in ('1.2.3.4', '1.2.3.200', '1.2.4.1'):
+        client.get('/api/hello', headers={'X-Forwarded-For': ip})
+    assert [c[1] for c in client.calls if c[0] == 'geo'] == [
+        '1.2.3.4', '1.2.4.1']
+
+
+def test_batch_lookups_are_charged_to_the_request(client):
+    response = client.post('/api/hello/batch', json={'visitors': [
+        {'ip': '1.2.3.4'}, {'ip': '5.6.7.8'}]})
+    assert response.status_code == 200
+
+    metrics = client.get('/metrics').get_data(as_text=True)
+    for phase, lookups in (('geolocation', 2), ('weather', 1)):
+        assert phase_sum(metrics, 'http_request_phase_operations', phase,
+                         '/api/hello/batch') >= lookups
+        assert phase_sum(metrics, 'http_request_phase_seconds', phase,
+                         '/api/hello/batch') > 0
+
+
+def test_batch_looks_up_each_ip_and_cell_once(client):
+    response = client.post('/api/hello/batch', json={'visitors': [
+        {'ip': '1.2.3.4', 'visitor_name': 'Ada'},
+        {'ip': '1.2.3.4', 'visitor_name': 'Bola'},
+        {'ip': '5.6.7.8'},
+        {'visitor_name': 'Caller'},
+    ]}, environ_base={'REMOTE_ADDR': '9.9.9.9'})
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [r['client_ip'] for r in results] == [
+        '1.2.3.4', '1.2.3.4', '5.6.7.8', '9.9.9.9']
+    assert results[1]['greeting'] == ('Hello, Bola!, the temperature is 28.5 '
+                                      'degrees Celcius in Lagos')
+    assert sorted(c[1] for c in client.calls if c[0] == 'geo') == [
+        '1.2.3.4', '5.6.7.8', '9.9.9.9']
+    # every location falls in the same weather cell
+    assert len([c for c in client.calls if c[0] == 'weather']) == 1
+
+
+@pytest.mark.parametrize('ip', [5, ['1.2.3.4'], '', None])
+def test_batch_rejects_bad_ips(client, ip):
+    response = client.post('/api/hello/batch',
+                           json={'visitors': [{'ip': '1.2.3.4'}, {'ip': ip}]})
+    assert response.status_code == 422
+    assert response.json['errors'][0]['field'] == 'ip'
+    assert client.calls == []
+
+
+if __name__ == '__main__':
+    pytest.main()
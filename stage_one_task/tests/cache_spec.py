@@ -0,0 +1,155 @@
+from threading import Event
+import os, sys, time
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as hello  # noqa: E402
+from common import cache  # noqa: E402
+from common.cache import TTLCache, StaleWhileRevalidateCache  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'monotonic', clock)
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    ttl_cache = TTLCache(maxsize=4, ttl=10)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2, ttl=30)
+    clock.now += 9
+    assert ttl_cache.get('a') == 1
+    clock.now += 1
+    assert ttl_cache.get('a') is None
+    assert ttl_cache.peek('a', 'gone') == 'gone'
+    assert ttl_cache.get('b') == 2
+    # expired entries are dropped when read
+    assert len(ttl_cache) == 1
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    ttl_cache = TTLCache(maxsize=2, ttl=10)
+    ttl_cache.set('a', 1)
+    ttl_cache.set('b', 2)
+    # reading a makes b the least recently used
+    ttl_cache.get('a')
+    ttl_cache.set('c', 3)
+    assert ttl_cache.peek('b') is None
+    assert ttl_cache.peek('a') == 1 and ttl_cache.peek('c') == 3
+    # peek does not refresh recency, so a goes next
+    ttl_cache.peek('a')
+    ttl_cache.set('d', 4)
+    assert ttl_cache.peek('a') is None
+    assert ttl_cache.evictions == 2
+
+
+def test_counters(clock):
+    ttl_cache = TTLCache(maxsize=1, ttl=10)
+    ttl_cache.get('a')
+    ttl_cache.set('a', 1)
+    ttl_cache.get('a')
+    ttl_cache.peek('a')
+    ttl_cache.set('b', 2)
+    clock.now += 10
+    ttl_cache.get('b')
+    assert ttl_cache.stats() == {'size': 0, 'maxsize': 1, 'ttl': 10,
+                                 'hits': 1, 'misses': 2, 'evictions': 1}
+    ttl_cache.clear()
+    assert (ttl_cache.hits, ttl_cache.misses, ttl_cache.evictions) == (0, 0, 0)
+
+
+def test_zero_maxsize_stores_nothing():
+    ttl_cache = TTLCache(maxsize=0)
+    ttl_cache.set('a', 1)
+    assert ttl_cache.get('a') is None
+    assert len(ttl_cache) == 0
+    assert ttl_cache.evictions == 0
+
+
+def wait_for_refresh(swr_cache):
+    deadline = time.monotonic() + 5
+    while swr_cache._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not swr_cache._refreshing
+
+
+def test_stale_value_is_served_while_one_refresh_runs(clock):
+    swr_cache = StaleWhileRevalidateCache(ttl=10, stale_ttl=60)
+    assert swr_cache.get_or_load('cell', lambda: 20.0) == 20.0
+    clock.now += 10
+
+    started, release, loads = Event(), Event(), []
+
+    def slow_loader():
+        loads.append(1)
+        started.set()
+        release.wait(5)
+        return 21.0
+
+    assert swr_cache.get_or_load('cell', slow_loader) == 20.0
+    assert started.wait(5)
+    # the refresh is still running, later readers neither wait nor reload
+    assert swr_cache.get_or_load('cell', slow_loader) == 20.0
+    assert loads == [1] and swr_cache.refreshes == 1
+
+    release.set()
+    wait_for_refresh(swr_cache)
+    assert swr_cache.get_entry('cell') == (21.0, False)
+
+
+def test_failed_refresh_keeps_the_stale_value(clock):
+    swr_cache = StaleWhileRevalidateCache(ttl=10, stale_ttl=60)
+    swr_cache.set('cell', 20.0)
+    clock.now += 30
+
+    def failing_loader():
+        raise RuntimeError('weather service down')
+
+    assert swr_cache.get_or_load('cell', failing_loader) == 20.0
+    wait_for_refresh(swr_cache)
+    assert swr_cache.get_entry('cell') == (20.0, True)
+    # the next reader tries again, until the stale window runs out
+    assert swr_cache.get_or_load('cell', failing_loader) == 20.0
+    wait_for_refresh(swr_cache)
+    assert swr_cache.refreshes == 2
+    clock.now += 40
+    assert swr_cache.get_or_load('cell', lambda: 22.0) == 22.0
+
+
+@pytest.mark.parametrize('grid, a, b, cell', [
+    (0.1, (6.452, 3.391), (6.46, 3.404), (6.5, 3.4)),
+    (0.5, (-33.87, 151.21), (-34.1, 150.9), (-34.0, 151.0)),
+    (0, (6.452, 3.391), (6.452, 3.391), (6.452, 3.391)),
+])
+def test_nearby_coordinates_share_a_weather_cell(monkeypatch, grid, a, b,
+                                                 cell):
+    monkeypatch.setattr(hello, 'WEATHER_GRID', grid)
+    assert hello.weather_cell(*a) == hello.weather_cell(*b) == cell
+
+
+@pytest.mark.parametrize('v4, v6, ip, key', [
+    (0, 0, '1.2.3.4', '1.2.3.4'),
+    (0, 0, '2001:DB8::0001', '2001:db8::1'),
+    (24, 0, '1.2.3.4', '1.2.3.0/24'),
+    (24, 48, '2001:db8:1:2::1', '2001:db8:1::/48'),
+    (24, 48, 'not-an-ip', 'not-an-ip'),
+])
+def test_geo_cache_key(monkeypatch, v4, v6, ip, key):
+    monkeypatch.setattr(hello, 'GEO_CACHE_PREFIX_V4', v4)
+    monkeypatch.setattr(hello, 'GEO_CACHE_PREFIX_V6', v6)
+    assert hello.geo_cache_key(ip) == key
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,78 @@
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geoip import GeoIPDatabase, convert  # noqa: E402
+
+
+@pytest.fixture
+def build(tmp_path):
+    """ convert csv text and open the resulting database """
+    opened = []
+
+    def builder(text):
+        csv_path, out_path = tmp_path / 'ranges.csv', tmp_path / 'geoip.bin'
+        csv_path.write_text(text)
+        count = convert(csv_path, out_path)
+        db = GeoIPDatabase.open(out_path)
+        opened.append(db)
+        assert len(db) == count
+        return db
+
+    yield builder
+    for db in opened:
+        db.close()
+
+
+def city(db, ip):
+    found = db.lookup(ip)
+    return found and found['city']
+
+
+def test_round_trip(build):
+    db = build('start,end,city,lat,lon\n'
+               '1.0.0.0,1.0.0.255,Lagos,6.45,3.39\n'
+               '8.8.8.0/24,Mountain View,37.4,-122.1\n'
+               '2001:db8::/32,Nowhere,0,0\n')
+    assert db.lookup('1.0.0.7') == {'city': 'Lagos', 'lat': 6.45, 'lon': 3.39}
+    assert city(db, '8.8.8.8') == 'Mountain View'
+    for ip in ('0.255.255.255', '1.0.1.0', '9.0.0.0', '2001:db8::1', 'nope'):
+        assert db.lookup(ip) is None
+
+
+def test_nested_ranges(build):
+    db = build('10.0.0.0,10.255.255.255,Outer,1,1\n'
+               '10.1.0.0/24,Inner,2,2\n'
+               '10.1.0.128/25,Innermost,3,3\n')
+    assert city(db, '10.0.0.1') == 'Outer'
+    assert city(db, '10.1.0.1') == 'Inner'
+    assert city(db, '10.1.0.200') == 'Innermost'
+    assert city(db, '10.1.1.0') == 'Outer'
+    assert city(db, '10.2.0.1') == 'Outer'
+    assert city(db, '10.255.255.255') == 'Outer'
+
+
+def test_partial_overlap_prefers_narrower_range(build):
+    db = build('20.0.0.0,20.0.0.99,Wide,1,1\n'
+               '20.0.0.50,20.0.0.119,Narrow,2,2\n')
+    assert city(db, '20.0.0.10') == 'Wide'
+    assert city(db, '20.0.0.60') == 'Narrow'
+    assert city(db, '20.0.0.110') == 'Narrow'
+    assert db.lookup('20.0.0.120') is None
+
+
+def test_bad_rows_are_skipped(build):
+    db = build('1.0.0.0,1.0.0.255,Lagos,6.45,3.39\n'
+               '2.0.0.0,2.0.0.255,Broken,north,east\n'
+               '3.0.0.0,3.0.0.255,Short\n'
+               '4.0.0.255,4.0.0.0,Backwards,1,1\n'
+               '5.0.0.0/8,Abuja,9.07,7.49\n')
+    assert len(db) == 2
+    assert city(db, '1.0.0.1') == 'Lagos'
+    assert city(db, '5.1.2.3') == 'Abuja'
+    assert db.lookup('2.0.0.1') is None
+
+
+if __name__ == '__main__':
+    pytest.main()
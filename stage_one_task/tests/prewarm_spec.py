@@ -0,0 +1,122 @@
+import os, sys, time
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prewarm  # noqa: E402
+from common.cache import StaleWhileRevalidateCache  # noqa: E402
+from prewarm import SpaceSaving, WeatherPrewarmer  # noqa: E402
+
+
+def test_counts_and_top():
+    sketch = SpaceSaving(capacity=3)
+    for key in 'aaabbc':
+        sketch.add(key)
+    assert sketch.top(2) == ['a', 'b']
+    assert len(sketch) == 3
+
+
+def test_full_sketch_replaces_least_counted_key():
+    sketch = SpaceSaving(capacity=2)
+    for key in 'aaab':
+        sketch.add(key)
+    # b is evicted and c inherits its count plus one
+    sketch.add('c')
+    assert sketch.top(2) == ['a', 'c']
+    assert sketch._counts == {'a': 3, 'c': 2}
+    # the lowest count is now 2, held by c alone
+    sketch.add('d')
+    assert sketch._counts == {'a': 3, 'd': 3}
+
+
+def test_eviction_matches_a_full_scan():
+    sketch = SpaceSaving(capacity=8)
+    for i in range(2000):
+        key = (i * 7919) % 23 if i % 3 else i % 5
+        if len(sketch) == sketch.capacity and key not in sketch._counts:
+            lowest = min(sketch._counts.values())
+            sketch.add(key)
+            assert sketch._counts[key] == lowest + 1
+        else:
+            sketch.add(key)
+        assert sketch._min == min(sketch._counts.values())
+
+
+def test_decay_halves_counts_and_drops_singletons():
+    sketch = SpaceSaving(capacity=4)
+    for key in 'aaaabbc':
+        sketch.add(key)
+    sketch.decay()
+    assert sketch._counts == {'a': 2, 'b': 1}
+    assert sketch._min == 1
+    sketch.add('b')
+    sketch.add('e')
+    assert sketch.top(3) == ['a', 'b', 'e']
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prewarm, 'monotonic', clock)
+    return clock
+
+
+def make_prewarmer(cells, budget, loads):
+    sketch = SpaceSaving()
+    for cell in cells:
+        sketch.add(cell)
+    cache = StaleWhileRevalidateCache(ttl=600, stale_ttl=600)
+
+    def loader(cell):
+        loads.append(cell)
+        return 20.0
+
+    return cache, WeatherPrewarmer(cache, loader, sketch,
+                                   budget_per_minute=budget, lead_time=60)
+
+
+def test_budget_limits_refreshes(clock):
+    loads = []
+    cache, prewarmer = make_prewarmer(range(5), budget=2, loads=loads)
+    prewarmer.run_once()
+    assert len(loads) == 2
+    prewarmer.run_once()
+    assert len(loads) == 2
+    # tokens refill at budget per minute
+    clock.now += 30
+    prewarmer.run_once()
+    assert len(loads) == 3
+    assert prewarmer.refreshed == 3
+
+
+def test_fresh_cells_are_not_refreshed(clock):
+    loads = []
+    cache, prewarmer = make_prewarmer(['hot'], budget=10, loads=loads)
+    cache.set('hot', 21.0)
+    prewarmer.run_once()
+    assert loads == []
+    # within lead_time of going stale, on the cache's own clock
+    cache._cache.set('hot', (21.0, time.monotonic() + 30))
+    prewarmer.run_once()
+    assert loads == ['hot']
+
+
+def test_sketch_decays_every_minute(clock):
+    cache, prewarmer = make_prewarmer(['a', 'a', 'b'], budget=0, loads=[])
+    prewarmer.run_once()
+    assert len(prewarmer.sketch) == 2
+    clock.now += 60
+    prewarmer.run_once()
+    assert prewarmer.sketch._counts == {'a': 1}
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,84 @@
+import asyncio, os, sys, threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from singleflight import SingleFlight, AsyncSingleFlight  # noqa: E402
+
+
+def run_together(flight, fn, callers=8):
+    """ call flight.do from several threads while fn is in flight """
+    results, errors = [], []
+
+    def caller():
+        try:
+            results.append(flight.do('key', fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results, errors
+
+
+def test_threads_share_one_call():
+    flight, release = SingleFlight(), threading.Event()
+
+    def fn():
+        release.wait(timeout=5)
+        return 'value'
+
+    threading.Timer(0.1, release.set).start()
+    results, errors = run_together(flight, fn)
+    assert results == ['value'] * 8 and errors == []
+    assert flight.calls + flight.shared == 8
+    assert flight.calls < 8
+
+
+def test_threads_share_the_exception():
+    flight, release = SingleFlight(), threading.Event()
+
+    def fn():
+        release.wait(timeout=5)
+        raise ValueError('upstream down')
+
+    threading.Timer(0.1, release.set).start()
+    results, errors = run_together(flight, fn)
+    assert results == [] and len(errors) == 8
+    assert all(isinstance(e, ValueError) for e in errors)
+    # the key is free again once the call finished
+    assert flight.do('key', lambda: 'next') == 'next'
+
+
+def test_async_waiters_survive_leader_cancellation():
+    async def main():
+        flight = AsyncSingleFlight()
+        started = []
+
+        async def fetch():
+            started.append(1)
+            await asyncio.sleep(0.05)
+            return 'value'
+
+        leader = asyncio.create_task(flight.do('key', fetch))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(flight.do('key', fetch))
+                   for _ in range(5)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*waiters)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return results, len(started), flight.calls
+
+    results, started, calls = asyncio.run(main())
+    assert results == ['value'] * 5
+    # one waiter took the call over, the rest shared it
+    assert started == calls == 2
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,153 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+import json, os, sys
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as hello  # noqa: E402
+import upstream  # noqa: E402
+from upstream import CircuitBreaker, CircuitOpen, UpstreamClient  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(upstream, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def stub():
+    """
+    local stand-in upstream answering every GET with stub.status and a
+    JSON location, recording the requested paths in stub.calls
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.calls.append(self.path)
+            body = json.dumps({'city': 'Lagos', 'lat': 6.45,
+                               'lon': 3.39}).encode()
+            self.send_response(server.status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.status = 200
+    server.calls = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/'
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_breaker_opens_and_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+
+    # one trial once reset_timeout has passed, none while it runs
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    # a failed trial opens the circuit again for a full reset_timeout
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_server_errors_trip_the_breaker(stub, clock):
+    client = UpstreamClient(retries=0, failure_threshold=2, reset_timeout=30)
+
+    # a 4xx still means the upstream is up
+    stub.status = 404
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            client.get_json(stub.url)
+    assert client.breaker(stub.url).state == CircuitBreaker.CLOSED
+
+    stub.status = 503
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            client.get_json(stub.url)
+    assert client.breaker(stub.url).state == CircuitBreaker.OPEN
+
+    # open: fail fast without calling the upstream
+    with pytest.raises(CircuitOpen):
+        client.get_json(stub.url)
+    assert len(stub.calls) == 5
+
+    # the trial succeeds and closes the circuit
+    stub.status = 200
+    clock.now += 30
+    assert client.get_json(stub.url)['city'] == 'Lagos'
+    assert client.breaker(stub.url).state == CircuitBreaker.CLOSED
+    client.close()
+
+
+def test_breakers_are_per_host(stub):
+    client = UpstreamClient(retries=0, failure_threshold=1)
+    stub.status = 503
+    with pytest.raises(requests.HTTPError):
+        client.get_json(stub.url)
+    other = stub.url.replace('127.0.0.1', 'localhost')
+    assert client.breaker(stub.url).state == CircuitBreaker.OPEN
+    assert client.breaker(other).state == CircuitBreaker.CLOSED
+    client.close()
+
+
+def test_hello_degrades_while_the_circuit_is_open(stub, monkeypatch):
+    client = UpstreamClient(retries=0, failure_threshold=1, reset_timeout=30)
+    monkeypatch.setattr(hello, 'upstream', client)
+    monkeypatch.setattr(hello, 'geoip_db', None)
+    monkeypatch.setattr(hello, 'GEOLOCATION_API_URL', stub.url + 'json/')
+    monkeypatch.setattr(hello, 'WEATHER_API_URL', stub.url + 'weather')
+    hello.geo_cache.clear()
+    hello.weather_cache.clear()
+    stub.status = 503
+
+    for ip in ('1.2.3.4', '5.6.7.8'):
+        response = hello.app.test_client().get(
+            '/api/hello', headers={'X-Forwarded-For': ip})
+        assert response.status_code == 200
+        assert response.json['location'] == 'Unknown'
+        assert 'N/A degrees' in response.json['greeting']
+    # the second request was refused by the open circuit
+    assert stub.calls == ['/json/1.2.3.4']
+    client.close()
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,115 @@
+from threading import Lock
+from time import monotonic
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class CircuitOpen(requests.RequestException):
+    """ raised instead of calling an upstream whose circuit is open """
+
+
+class CircuitBreaker:
+    """
+    stops calls to an upstream after repeated failures, letting a single
+    trial call through once reset_timeout seconds have passed
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = Lock()
+
+    def allow(self):
+        """ return True if a call may be made now """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN
+                    and monotonic() - self._opened_at >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if (self.state == self.HALF_OPEN
+                    or self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = monotonic()
+
+
+class UpstreamClient:
+    """
+    shared keep-alive HTTP client with timeouts, bounded retries and a
+    circuit breaker per upstream host
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=2.0, read_timeout=5.0,
+                 retries=2, backoff=0.2, failure_threshold=5,
+                 reset_timeout=30.0):
+        self.timeout = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self._lock = Lock()
+
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def breaker(self, url):
+        """ return the circuit breaker guarding url's host """
+        host = urlsplit(url).netloc
+        with self._lock:
+            breaker = self.breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold,
+                                         self.reset_timeout)
+                self.breakers[host] = breaker
+            return breaker
+
+    def get_json(self, url, params=None):
+        """
+        GET url and return the decoded JSON body, raising
+        requests.RequestException (or CircuitOpen) on failure
+        """
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise CircuitOpen(f'circuit open for {urlsplit(url).netloc}')
+        try:
+            response = self.session.get(url, params=params,
+                                        timeout=self.timeout)
+        except requests.RequestException:
+            breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            # a 4xx still means the upstream is up
+            breaker.record_success()
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,86 @@
+
+from models import Base, User, Organization
+from sqlalchemy.ext.asyncio import (
+    create_async_engine,
+    async_sessionmaker,
+    async_scoped_session,
+)
+from sqlalchemy import select
+from dotenv import load_dotenv
+from os import getenv
+from asyncio import current_task
+
+
+class AsyncDatabase:
+    """
+    asyncio counterpart of db.Database for async route handlers; each
+    task gets its own session. Relationships are not lazy loaded on
+    this backend, so query what a handler needs explicitly
+    """
+    __engine = None
+    __session = None
+
+    _entity_mapping = {
+        'user': User,
+        'org': Organization,
+    }
+
+    def __init__(self, url: str = None):
+        load_dotenv()
+        if url is None:
+            # Database credentials
+            username = getenv('db_user')
+            password = getenv('db_pass')
+            host = getenv('db_host')
+            port = getenv('db_port')
+            database = getenv('db')
+            url = f'postgresql+asyncpg://{username}:{password}@{host}:{port}/{database}'
+
+        engine_args = {'pool_pre_ping': True}
+        if not url.startswith('sqlite'):
+            engine_args.update(
+                pool_size=int(getenv('db_pool_size', 5)),
+                max_overflow=int(getenv('db_max_overflow', 10)),
+                pool_recycle=int(getenv('db_pool_recycle', 1800)))
+
+        # Create an engine
+        self.__engine = create_async_engine(url, **engine_args)
+
+    async def reload(self):
+        """
+        create the tables and the session factory, run once at startup
+        """
+        async with self.__engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        self.__session = async_scoped_session(
+            async_sessionmaker(bind=self.__engine, expire_on_commit=False),
+            scopefunc=current_task)
+
+    async def save(self, obj):
+        """ save object to database """
+        try:
+            self.__session.add(obj)
+            await self.__session.commit()
+        except Exception:
+            await self.__session.rollback()
+            raise
+
+    async def close(self):
+        """ close the current task's session, returning its connection """
+        await self.__session.remove()
+
+    async def dispose(self):
+        """ close every pooled connection """
+        await self.__engine.dispose()
+
+    async def get_one(self, obj: str, filter: dict):
+        """ get data from database """
+        try:
+            obj = self._entity_mapping.get(obj.lower())
+            result = await self.__session.execute(
+                select(obj).filter_by(**filter).limit(1))
+        except Exception:
+            return None
+
+        return result.scalars().first()
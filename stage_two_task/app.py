@@ -7,10 +7,25 @@ from flask_jwt_extended import (
     JWTManager,
 )
 from datetime import timedelta
-from models import User, Organization
+from sqlalchemy.exc import IntegrityError
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as Base64Error
+from io import TextIOWrapper
 from dotenv import load_dotenv
 from os import getenv
-from db import storage  # as st
+import os
+import sys
+
+# the common package, shared by both apps, lives at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.cache import TTLCache  # noqa: E402
+from common import metrics  # noqa: E402
+from models import User, Organization, uuid_str  # noqa: E402
+from db import storage  # noqa: E402
+from hashing import hasher, HasherBusy  # noqa: E402
+from importer import import_users, read_rows, UnreadableInput  # noqa: E402
+from serializer import init_json  # noqa: E402
 
 
 load_dotenv()
@@ -21,6 +36,13 @@ app.url_map.strict_slashes = False
 app.config['JWT_SECRET_KEY'] = getenv('jwtSecretKey')
 app.config['DEBUG'] = True
 jwt = JWTManager(app)
+init_json(app)
+
+# per-route latency histograms at /metrics
+if getenv('metrics_enabled', '1') == '1':
+    metrics.init_app(app, phases=('db', 'bcrypt', 'serialize'))
+    for engine in storage.engines:
+        metrics.instrument_engine(engine)
 
 # cross origin requesbt site
 CORS(app, resources={r"/*": {"origins": "*"}},
@@ -28,10 +50,55 @@ CORS(app, resources={r"/*": {"origins": "*"}},
      supports_credentials=True)
 
 
-@app.before_request
-def load_database_conn():
-    # reload database
-    storage.reload()
+# page size limits for list endpoints
+DEFAULT_PAGE_SIZE = int(getenv('default_page_size', 100))
+MAX_PAGE_SIZE = int(getenv('max_page_size', 500))
+# most user ids accepted by one bulk membership request
+MAX_BULK_MEMBERS = int(getenv('max_bulk_members', 10000))
+# operators allowed to bulk import users, comma separated userIds; with
+# none configured the import endpoint is closed and only the CLI works
+ADMIN_USER_IDS = frozenset(filter(None, (
+    uuid_str(user_id.strip())
+    for user_id in getenv('admin_user_ids', '').split(','))))
+
+# authenticated requesters (their user summary) by userId; memberships
+# are not cached, they are checked with one indexed query per request
+principals = TTLCache(maxsize=int(getenv('principal_cache_size', 10000)),
+                      ttl=float(getenv('principal_cache_ttl', 60)))
+
+
+def get_principal(user_id):
+    """ cached summary of the requesting user, None if no such user """
+    principal = principals.get(user_id)
+    if principal is None:
+        principal = storage.get_view(obj='user', filter={'userId': user_id})
+        if principal is not None:
+            principals.set(user_id, principal)
+    return principal
+
+
+def encode_cursor(key):
+    """ opaque pagination token for the last key of a page """
+    return urlsafe_b64encode(key.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """ key encoded by encode_cursor, raises ValueError if malformed """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        return urlsafe_b64decode(cursor + padding).decode('utf-8')
+    except (Base64Error, UnicodeDecodeError) as e:
+        raise ValueError(str(e))
+
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(e):
+    # too many password hashes queued, shed load instead of piling up
+    return jsonify({
+        "status": "Service unavailable",
+        "message": "Server busy, try again later",
+        "statusCode": 503
+    }), 503
 
 
 @app.teardown_appcontext
@@ -61,25 +128,24 @@ def create_user():
     password = request.json.get('password')
     phone = request.json.get('phone', None)
 
-    # check if user already exists
-    user_exist = storage.get_one(obj='User', filter={'email': email})
-    # return 409 error if user already exist
-    if user_exist:
-        return jsonify({
-            "status": "Conflict",
-            "message": "User already exist",
-            "statusCode": 422
-        }), 422
-
     try:
         new_user = User(firstName=firstName, lastName=lastName,
                         email=email, password=password, phone=phone)
         new_org = Organization(name=f"{firstName}'s Organisation")
-        # save user and org to database
+        # save user, org and membership in a single commit
         new_user.organizations.append(new_org)
         new_user.save()
         # new_org.save()
+    except HasherBusy:
+        raise
     except Exception as e:
+        # the unique email constraint decides whether user already exist
+        if isinstance(e, IntegrityError) and storage.is_duplicate_email(e):
+            return jsonify({
+                "status": "Conflict",
+                "message": "User already exist",
+                "statusCode": 422
+            }), 422
         return jsonify({
             "status": "Bad request",
             "message": "Registration unsuccessful",
@@ -119,7 +185,7 @@ def log_in():
         return jsonify(errors=errors), 422
 
     # get user from database
-    user = storage.get_one(obj='user', filter={"email": email})
+    user = storage.get_user_by_email(email)
     
     if not user:
         return jsonify(
@@ -140,6 +206,15 @@ def log_in():
             }
         ), 401
 
+    # re-hash with the configured cost if it changed since the last login;
+    # a full hashing queue leaves it to a later login
+    if hasher.needs_rehash(user.password):
+        try:
+            user.password = hasher.hash(password)
+            user.save()
+        except HasherBusy:
+            pass
+
     expires = timedelta(days=2)
     access_token = create_access_token(identity=user.userId, expires_delta=expires)
 
@@ -155,6 +230,53 @@ def log_in():
     return jsonify(response)
 
 
+@app.post('/api/users/import')
+@jwt_required()
+def bulk_import_users():
+    """ create users from a streamed CSV or NDJSON body, operators only """
+    if get_jwt_identity() not in ADMIN_USER_IDS:
+        return jsonify(
+            {
+                "status": "Forbidden",
+                "message": "Only operators may import users",
+                "statusCode": 403
+            }
+        ), 403
+
+    formats = {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'ndjson',
+        'application/jsonl': 'ndjson',
+    }
+    fmt = formats.get(request.mimetype)
+    if not fmt:
+        return jsonify(
+            {
+                "status": "Unsupported media type",
+                "message": "Body must be text/csv or application/x-ndjson",
+                "statusCode": 415
+            }
+        ), 415
+
+    stream = TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    try:
+        report = import_users(storage, read_rows(stream, fmt))
+    except UnreadableInput as e:
+        # batches before the unreadable row are already committed
+        return jsonify({
+            "status": "Unprocessable Entity",
+            "message": "Import stopped at a row that could not be read",
+            "statusCode": 422,
+            "data": e.report
+        }), 422
+
+    return jsonify({
+        "status": "success",
+        "message": "Import complete",
+        "data": report
+    }), 200
+
+
 @app.get('/api/users/<string:id>')
 @jwt_required()
 def get_user(id):
@@ -163,12 +285,12 @@ def get_user(id):
     """
     requester_id = get_jwt_identity()
 
-    # retrieve requester data
-    requester = storage.get_one(obj='user', filter={'userId': requester_id})
     # retrieve user data
-    user = storage.get_one(obj='user', filter={'userId': id})
-    
-    if not requester or not user:
+    user = storage.get_view(obj='user', filter={'userId': id})
+
+    # a missing requester shares no organisation, so only look it up then
+    shared = user and storage.share_organisation(requester_id, id)
+    if not user or (not shared and not get_principal(requester_id)):
         return jsonify(
             {
                 "status": "Not found",
@@ -176,14 +298,8 @@ def get_user(id):
                 "statusCode": 404
             }
         ), 404
-    
-    requester_org_ids = {org.orgId for org in requester.organizations}
-    target_org_ids = {org.orgId for org in user.organizations}
-    
-    # Check if there is any common organization
-    common_org_ids = requester_org_ids.intersection(target_org_ids)
-    
-    if not common_org_ids:
+
+    if not shared:
         return jsonify(
             {
                 "status": "Forbidden",
@@ -191,7 +307,7 @@ def get_user(id):
                 "statusCode": 403
             }
         ), 403
-    
+
     response = {
         'status': 'success',
         "message": "Request successful",
@@ -206,12 +322,29 @@ def get_user(id):
 @app.get('/api/organisations')
 @jwt_required()
 def get_org_user_belong():
-    """ Retrieves all organisation user belongs to """
+    """ Retrieves a page of the organisations user belongs to """
     user_id = get_jwt_identity()
 
-    # get user from database
-    user = storage.get_one(obj='user', filter={'userId': user_id})
-    if not user:
+    errors = []
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError
+    except ValueError:
+        errors.append({'field': 'limit',
+                       'message': f'limit must be between 1 and {MAX_PAGE_SIZE}'})
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = uuid_str(decode_cursor(request.args['cursor']))
+            if after is None:
+                raise ValueError
+        except ValueError:
+            errors.append({'field': 'cursor', 'message': 'invalid cursor'})
+    if errors:
+        return jsonify(errors=errors), 422
+
+    if not get_principal(user_id):
         return jsonify(
             {
                 "status": "Bad request",
@@ -220,13 +353,21 @@ def get_org_user_belong():
             }
         ), 404
 
-    user_organizations = [org.to_dict() for org in user.organizations]
+    # fetch one extra row to learn whether another page follows
+    orgs = storage.get_user_organisations(user_id, limit + 1, after=after)
+    next_cursor = None
+    if len(orgs) > limit:
+        orgs = orgs[:limit]
+        next_cursor = encode_cursor(orgs[-1].orgId)
+
+    user_organizations = [org.to_dict() for org in orgs]
 
     response = {
         "status": "success",
         "message": "User organisation retrieval successful",
         "data": {
-            "organisations": user_organizations
+            "organisations": user_organizations,
+            "nextCursor": next_cursor
         }
     }
 
@@ -240,7 +381,7 @@ def get_org_with_id(orgId):
 
     user_id = get_jwt_identity()
 
-    org = storage.get_one(obj='org', filter={'orgId': orgId})
+    org = storage.get_view(obj='org', filter={'orgId': orgId})
     if not org:
         return jsonify(
             {
@@ -250,8 +391,9 @@ def get_org_with_id(orgId):
             }
         ), 404
 
-    user = storage.get_one(obj='user', filter={'userId': user_id})
-    if not user:
+    # a missing user is not a member, so only look it up then
+    member = storage.is_member(user_id, orgId)
+    if not member and not get_principal(user_id):
         return jsonify(
             {
                 "status": "Bad request",
@@ -260,7 +402,7 @@ def get_org_with_id(orgId):
             }
         ), 404
 
-    if org not in user.organizations:
+    if not member:
         return jsonify(
             {
                 "status": "Forbidden",
@@ -304,7 +446,7 @@ def user_create_og():
     # add org to user's org collection
     user.organizations.append(org)
     user.save()
-    
+
     org.name # this line loads the attrs, I dont know why its like that, its most likelya python 3.10.12 bug
     org = org.to_dict()
 
@@ -327,7 +469,7 @@ def add_user_to_org(orgId):
             ]}), 422
 
     # get org from database
-    org = storage.get_one(obj='org', filter={'orgId': orgId})
+    org = storage.get_view(obj='org', filter={'orgId': orgId})
     if not org:
         return jsonify(
             {
@@ -337,7 +479,7 @@ def add_user_to_org(orgId):
             }
         ), 404
     
-    user = storage.get_one(obj='user', filter={'userId': user_id})
+    user = storage.get_view(obj='user', filter={'userId': user_id})
     if not user:
         return jsonify(
             {
@@ -347,7 +489,7 @@ def add_user_to_org(orgId):
             }
         ), 404
     
-    if org in user.organizations:
+    if not storage.add_member(user_id, orgId):
         return jsonify(
             {
                 "status": "Conflict",
@@ -355,15 +497,62 @@ def add_user_to_org(orgId):
                 "statusCode": 409
             }
         ), 409
-    
-    user.organizations.append(org)
-    user.save()
-    
+
     return jsonify({
         "status": "success",
         "message": "User added to organisation successfully",
     }), 200
 
 
+@app.post('/api/organisations/<string:orgId>/users/bulk')
+@jwt_required()
+def add_users_to_org(orgId):
+    """ add many users to an organisation """
+    user_ids = (request.get_json(silent=True) or {}).get('userIds')
+
+    if (not isinstance(user_ids, list) or not user_ids
+            or not all(isinstance(user_id, str) for user_id in user_ids)):
+        return jsonify({'errors': [
+            {'field': 'userIds', 'message': 'userIds must be a list of user ids'}
+            ]}), 422
+    if len(user_ids) > MAX_BULK_MEMBERS:
+        return jsonify({'errors': [
+            {'field': 'userIds',
+             'message': f'at most {MAX_BULK_MEMBERS} userIds per request'}
+            ]}), 422
+
+    # get org from database
+    org = storage.get_view(obj='org', filter={'orgId': orgId})
+    if not org:
+        return jsonify(
+            {
+                "status": "Not found",
+                "message": "Organisation does not exist",
+                "statusCode": 404
+            }
+        ), 404
+
+    # only members may add users to an organisation
+    if not storage.is_member(get_jwt_identity(), orgId):
+        return jsonify(
+            {
+                "status": "Forbidden",
+                "message": "User is not authorized to add users to organisation",
+                "statusCode": 403
+            }
+        ), 403
+
+    outcomes = storage.add_members(orgId, user_ids)
+
+    return jsonify({
+        "status": "success",
+        "message": "Users processed",
+        "data": {
+            "results": [{'userId': user_id, 'status': status}
+                        for user_id, status in outcomes.items()]
+        }
+    }), 200
+
+
 if __name__ == '__main__':
     app.run(port=5000)
@@ -1,62 +1,347 @@
 
-from models import User, Organization
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from models import User, Organization, user_organizations, uuid_str
+from dto import UserView, OrgView
+from sqlalchemy.orm import sessionmaker, scoped_session, object_session
+from sqlalchemy import (
+    create_engine, event, inspect, select, literal, make_url, func
+)
+from sqlalchemy.exc import StatementError
+from sqlalchemy.pool import StaticPool
 from dotenv import load_dotenv
 from os import getenv
+from uuid import uuid4
+from itertools import cycle
+from threading import local
 
 
 class Database:
     __engine = None
     __session = None
+    __read_session = None
     
     _entity_mapping = {
         'user': User,
         'org': Organization,
     }
 
-    def __init__(self):
+    _view_mapping = {
+        'user': UserView,
+        'org': OrgView,
+    }
+
+    # backends whose INSERT can skip conflicting rows and return the rest
+    _backends = ('postgresql', 'sqlite')
+
+    def __init__(self, url: str = None, replica_urls: list = None):
         load_dotenv()
-        # Database credentials
-        username = getenv('db_user')
-        password = getenv('db_pass')
-        host = getenv('db_host')
-        port = getenv('db_port')
-        database = getenv('db')
+        # a PostgreSQL or SQLite SQLAlchemy URL; db_url, then the Postgres
+        # credentials below
+        url = url or getenv('db_url')
+        if url is None:
+            # Database credentials
+            username = getenv('db_user')
+            password = getenv('db_pass')
+            host = getenv('db_host')
+            port = getenv('db_port')
+            database = getenv('db')
+            url = f'postgresql+psycopg2://{username}:{password}@{host}:{port}/{database}'
 
         # Create an engine
-        self.__engine = create_engine(
-            f'postgresql+psycopg2://{username}:{password}@{host}:{port}/{database}', pool_pre_ping=True)
+        self.__engine = self._create_engine(url)
+
+        # read replicas, comma separated SQLAlchemy URLs
+        if replica_urls is None:
+            replica_urls = [url.strip() for url in
+                            getenv('db_replica_urls', '').split(',')
+                            if url.strip()]
+        self.__replicas = [self._create_engine(url) for url in replica_urls]
+        # set once the current request has written to the primary
+        self.__pinned = local()
+
+    @classmethod
+    def _create_engine(cls, url: str):
+        """
+        engine for url, with pool settings that suit its backend; raises
+        ValueError for a backend the bulk inserts can't run on
+        """
+        url = make_url(url)
+        backend = url.get_backend_name()
+        if backend not in cls._backends:
+            raise ValueError(f'unsupported database {backend}, use '
+                             'PostgreSQL or SQLite')
+        if backend != 'sqlite':
+            # Connection pool settings
+            return create_engine(
+                url, pool_pre_ping=True,
+                pool_size=int(getenv('db_pool_size', 5)),
+                max_overflow=int(getenv('db_max_overflow', 10)),
+                pool_recycle=int(getenv('db_pool_recycle', 1800)))
+
+        if url.database in (None, '', ':memory:'):
+            # one shared connection, or every thread sees its own database
+            engine = create_engine(
+                url, poolclass=StaticPool,
+                connect_args={'check_same_thread': False})
+        else:
+            # connections are cheap and local; keep one per busy thread
+            engine = create_engine(
+                url, pool_size=int(getenv('db_pool_size', 5)),
+                max_overflow=int(getenv('db_max_overflow', 10)))
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            # readers don't block the writer, nor it them
+            cursor.execute('PRAGMA journal_mode=WAL')
+            # fsync at checkpoints only, still safe with WAL
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            # page cache per connection, in KiB
+            cursor.execute(
+                f"PRAGMA cache_size=-{int(getenv('sqlite_cache_size', 65536))}")
+            cursor.execute(
+                f"PRAGMA mmap_size={int(getenv('sqlite_mmap_size', 268435456))}")
+            cursor.execute('PRAGMA temp_store=MEMORY')
+            # wait for a concurrent writer instead of failing
+            cursor.execute(
+                f"PRAGMA busy_timeout={int(getenv('sqlite_busy_timeout', 5000))}")
+            cursor.close()
+
+        return engine
+
+    @property
+    def engines(self):
+        """ the primary engine followed by any replica engines """
+        return [self.__engine] + self.__replicas
 
     def reload(self):
-        # Create the tables
+        """
+        create the tables and the session factory, run once at startup
+        """
         from models import Base
         Base.metadata.create_all(self.__engine)
 
-        # Create a session
-        Session = sessionmaker(bind=self.__engine)
-        self.__session = Session()
+        # one session per thread (or greenlet, when monkey patched);
+        # sessions live for one request, so keep loaded attributes after
+        # commit instead of re-selecting each saved row
+        self.__session = scoped_session(sessionmaker(bind=self.__engine,
+                                                     expire_on_commit=False))
+        if self.__replicas:
+            replica_sessions = [sessionmaker(bind=engine,
+                                             expire_on_commit=False)
+                                for engine in self.__replicas]
+            # spread new request sessions across the replicas
+            self.__read_session = scoped_session(
+                lambda sessions=cycle(replica_sessions): next(sessions)())
+
+    def _reader(self):
+        """
+        session for read-only queries: a replica, unless there is none or
+        this request already wrote to the primary (read-your-writes)
+        """
+        if self.__read_session is None or getattr(self.__pinned, 'value',
+                                                  False):
+            return self.__session
+        return self.__read_session
+
+    def _pin(self):
+        """ send the rest of this request's reads to the primary """
+        self.__pinned.value = True
 
     def save(self, obj):
         """ save object to database """
-        self.__session.add(obj)
-        self.__session.commit()
-        
-        
+        self._pin()
+        if (self.__read_session is not None
+                and object_session(obj) is self.__read_session()):
+            # loaded from a replica; detach obj and the objects it cascades
+            # to so they can move to the primary, leaving the rest loaded
+            read_session = self.__read_session()
+            state = inspect(obj)
+            related = [related for related, *_ in
+                       state.mapper.cascade_iterator('save-update', state)]
+            for loaded in [obj] + related:
+                if object_session(loaded) is read_session:
+                    read_session.expunge(loaded)
+        try:
+            self.__session.add(obj)
+            self.__session.commit()
+        except Exception:
+            self.__session.rollback()
+            raise
+
     def close(self):
-        """ close database session """
-        self.__session.close()
+        """ close the current thread's sessions, returning their connections """
+        self.__session.remove()
+        if self.__read_session is not None:
+            self.__read_session.remove()
+        self.__pinned.value = False
 
     def get_one(self, obj: str, filter: dict):
         """ get data from database """
         try:
             obj = self._entity_mapping.get(obj.lower())
-            q = self.__session.query(obj).filter_by(**filter).first()
+            q = self._reader().query(obj).filter_by(**filter).first()
         except Exception:
             return None
         
         return q
 
+    def get_view(self, obj: str, filter: dict):
+        """
+        get a slim read-only projection of one row, None if there is no
+        match or a key in filter is not a valid id
+        """
+        key = obj.lower()
+        entity = self._entity_mapping.get(key)
+        view = self._view_mapping.get(key)
+        q = select(*[getattr(entity, column) for column in view.__slots__]
+                   ).filter_by(**filter).limit(1)
+        try:
+            row = self._reader().execute(q).first()
+        except StatementError:
+            # rejected while binding parameters, nothing reached the database
+            return None
+        return view(*row) if row else None
+
+    def get_user_by_email(self, email: str):
+        """ get a user by email ignoring case, through the lower(email) index """
+        if not isinstance(email, str):
+            return None
+        q = select(User).where(func.lower(User.email) == email.lower()).limit(1)
+        return self._reader().execute(q).scalars().first()
+
+    def is_member(self, user_id: str, org_id: str) -> bool:
+        """ check if user belongs to organisation """
+        q = select(literal(1)).where(
+            user_organizations.c.user_id == user_id,
+            user_organizations.c.organization_id == org_id,
+        ).limit(1)
+        return self._reader().execute(q).first() is not None
+
+    def add_member(self, user_id: str, org_id: str) -> bool:
+        """
+        add user to organisation unless already a member,
+        returns True if the membership was created
+        """
+        self._pin()
+        q = self._insert_ignore(user_organizations).values(
+            user_id=user_id, organization_id=org_id)
+        result = self.__session.execute(q)
+        self.__session.commit()
+        return result.rowcount == 1
+
+    def add_members(self, org_id: str, user_ids: list) -> dict:
+        """
+        add users to organisation with one lookup and one insert,
+        returns {userId: 'added' | 'already member' | 'not found'}
+        """
+        self._pin()
+        user_ids = list(dict.fromkeys(user_ids))
+        # ids as the database returns them; malformed ids match no user
+        canonical = {user_id: uuid_str(user_id) for user_id in user_ids}
+        found = set(self.__session.execute(
+            select(User.userId).where(User.userId.in_(
+                [uuid for uuid in set(canonical.values()) if uuid]))).scalars())
+        added = set()
+        if found:
+            q = self._insert_ignore(user_organizations).values([
+                {'user_id': user_id, 'organization_id': org_id}
+                for user_id in found
+            ]).returning(user_organizations.c.user_id)
+            added = set(self.__session.execute(q).scalars())
+        self.__session.commit()
+        outcomes = {}
+        for user_id in user_ids:
+            uuid = canonical[user_id]
+            if uuid in added:
+                # another spelling of the same id is already a member
+                added.discard(uuid)
+                outcomes[user_id] = 'added'
+            elif uuid in found:
+                outcomes[user_id] = 'already member'
+            else:
+                outcomes[user_id] = 'not found'
+        return outcomes
+
+    def create_users(self, users: list) -> set:
+        """
+        insert users, each with a default organisation, in one transaction
+        of multi-row INSERTs; users whose email is already taken, in any
+        case, are skipped. returns the emails of the users created
+        """
+        if not users:
+            return set()
+        self._pin()
+        users_table = User.__table__
+        q = self._insert_ignore(users_table).values(users).returning(
+            users_table.c.userId, users_table.c.email)
+        created = dict(self.__session.execute(q).all())
+        orgs, members = [], []
+        for user in users:
+            if user['userId'] in created:
+                org_id = str(uuid4())
+                orgs.append({'orgId': org_id,
+                             'name': f"{user['firstName']}'s Organisation",
+                             'description': None})
+                members.append({'user_id': user['userId'],
+                                'organization_id': org_id})
+        if orgs:
+            self.__session.execute(
+                Organization.__table__.insert().values(orgs))
+            self.__session.execute(user_organizations.insert().values(members))
+        self.__session.commit()
+        return set(created.values())
+
+    @staticmethod
+    def is_duplicate_email(error) -> bool:
+        """ check if an IntegrityError was raised by the unique email key """
+        orig = error.orig
+        diag = getattr(orig, 'diag', None)
+        if diag is not None:
+            # psycopg2 names the violated constraint
+            return (orig.pgcode == '23505'
+                    and 'email' in (diag.constraint_name or ''))
+        message = str(orig).lower()
+        return 'unique' in message and 'email' in message
+
+    def _insert_ignore(self, table):
+        """ INSERT statement that skips rows violating a unique key """
+        dialect = self.__engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing()
+
+    def get_user_organisations(self, user_id: str, limit: int,
+                               after: str = None):
+        """
+        get up to limit organisations of a user ordered by orgId, starting
+        after the given orgId; walks the (user_id, organization_id)
+        primary key of user_organizations
+        """
+        q = select(Organization.orgId, Organization.name,
+                   Organization.description).join(
+            user_organizations,
+            user_organizations.c.organization_id == Organization.orgId
+        ).where(user_organizations.c.user_id == user_id)
+        if after is not None:
+            q = q.where(user_organizations.c.organization_id > after)
+        q = q.order_by(user_organizations.c.organization_id).limit(limit)
+        return [OrgView(*row) for row in self._reader().execute(q)]
+
+    def share_organisation(self, user_id: str, other_id: str) -> bool:
+        """ check if two users belong to at least one common organisation """
+        mine = user_organizations.alias('mine')
+        theirs = user_organizations.alias('theirs')
+        q = select(literal(1)).select_from(
+            mine.join(theirs,
+                      mine.c.organization_id == theirs.c.organization_id)
+        ).where(
+            mine.c.user_id == user_id,
+            theirs.c.user_id == other_id,
+        ).limit(1)
+        return self._reader().execute(q).first() is not None
 
 
 storage = Database()
+storage.reload()
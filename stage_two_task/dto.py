@@ -0,0 +1,37 @@
+class UserView:
+    """ read-only projection of the public columns of a user """
+    __slots__ = ('userId', 'firstName', 'lastName', 'email', 'phone')
+
+    def __init__(self, userId, firstName, lastName, email, phone):
+        self.userId = userId
+        self.firstName = firstName
+        self.lastName = lastName
+        self.email = email
+        self.phone = phone
+
+    def to_dict(self):
+        return {
+            'userId': self.userId,
+            'firstName': self.firstName,
+            'lastName': self.lastName,
+            'email': self.email,
+            'phone': self.phone,
+        }
+
+
+class OrgView:
+    """ read-only projection of an organisation """
+    __slots__ = ('orgId', 'name', 'description')
+
+    def __init__(self, orgId, name, description):
+        self.orgId = orgId
+        self.name = name
+        self.description = description
+
+    def to_dict(self):
+        return {
+            'orgId': self.orgId,
+            'name': self.name,
+            'description': self.description,
+        }
+
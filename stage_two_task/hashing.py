@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from dotenv import load_dotenv
+from os import getenv
+import bcrypt
+from common.metrics import timed
+
+
+class HasherBusy(Exception):
+    """ raised when the hashing queue is full """
+
+
+class PasswordHasher:
+    """
+    runs bcrypt on a bounded worker pool so a burst of logins can only
+    occupy `workers` cores and `max_queue` waiting requests; bcrypt
+    releases the GIL while it works, so threads run it in parallel
+    """
+
+    def __init__(self, rounds=12, workers=4, max_queue=64):
+        self.rounds = rounds
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='bcrypt')
+        self._slots = BoundedSemaphore(workers + max_queue)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('password hashing queue is full')
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        with timed('bcrypt'):
+            return future.result()
+
+    def hash(self, password):
+        """ return the bcrypt hash of password using the configured cost """
+        return self._run(self._hash, password)
+
+    def hash_many(self, passwords):
+        """
+        hash passwords in parallel on the pool; keeps at most `workers`
+        of them queued and waits for room rather than failing, so logins
+        still find free slots while a bulk import runs
+        """
+        batch_slots = BoundedSemaphore(self.workers)
+
+        def release(_):
+            self._slots.release()
+            batch_slots.release()
+
+        futures = []
+        for password in passwords:
+            batch_slots.acquire()
+            self._slots.acquire()
+            try:
+                future = self._executor.submit(self._hash, password)
+            except Exception:
+                release(None)
+                raise
+            future.add_done_callback(release)
+            futures.append(future)
+        with timed('bcrypt'):
+            return [future.result() for future in futures]
+
+    def verify(self, password, hashed):
+        """ check password against a stored bcrypt hash """
+        return self._run(bcrypt.checkpw, password.encode('utf-8'),
+                         hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        """ True when hashed was made with a different cost than configured """
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _hash(self, password):
+        return bcrypt.hashpw(password.encode('utf-8'),
+                             bcrypt.gensalt(self.rounds)).decode('utf-8')
+
+
+load_dotenv()
+
+hasher = PasswordHasher(rounds=int(getenv('bcrypt_rounds', 12)),
+                        workers=int(getenv('bcrypt_workers', 4)),
+                        max_queue=int(getenv('bcrypt_max_queue', 64)))
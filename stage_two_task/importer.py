@@ -0,0 +1,128 @@
+"""
+bulk user import from CSV or NDJSON
+
+usage: python importer.py users.csv|users.ndjson [batch_size]
+"""
+from itertools import islice
+from uuid import uuid4
+import csv
+import json
+import os
+import sys
+
+# run as a script, hashing still needs the common package at the root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hashing import hasher  # noqa: E402
+
+
+REQUIRED_FIELDS = ['firstName', 'lastName', 'email', 'password']
+
+
+class UnreadableInput(ValueError):
+    """
+    raised when the input stops decoding or parsing part way; report
+    holds what was imported before that, including the failing row
+    """
+
+    def __init__(self, report):
+        super().__init__(report['errors'][-1]['message'])
+        self.report = report
+
+
+def read_rows(stream, fmt):
+    """ yield user dictionaries from a text stream of csv or ndjson """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else {}
+
+
+def _readable(rows, failures):
+    """ yield rows until one fails to decode or parse, noting the error """
+    try:
+        yield from rows
+    except (UnicodeDecodeError, csv.Error) as e:
+        failures.append(e)
+
+
+def import_users(storage, rows, batch_size=500):
+    """
+    create users (and their default organisation) from rows, hashing
+    passwords in parallel and inserting in batches; rows that are
+    invalid or whose email is taken are reported, not fatal; input that
+    can't be decoded or parsed ends the import with UnreadableInput,
+    after the batches read before it are committed
+    """
+    report = {'created': 0, 'conflicts': [], 'errors': []}
+    seen = set()
+    failures = []
+    numbered = enumerate(_readable(rows, failures), start=1)
+    last_row = 0
+    while True:
+        batch = list(islice(numbered, batch_size))
+        if not batch:
+            report['conflicts'].sort(key=lambda conflict: conflict['row'])
+            if failures:
+                report['errors'].append(
+                    {'row': last_row + 1,
+                     'message': f'Row could not be read: {failures[0]}'})
+                raise UnreadableInput(report)
+            return report
+        last_row = batch[-1][0]
+
+        valid = []
+        for row_number, row in batch:
+            missing = [field for field in REQUIRED_FIELDS
+                       if not isinstance(row.get(field), str) or not row[field]]
+            if missing:
+                report['errors'].extend(
+                    {'row': row_number, 'field': field,
+                     'message': f'{field} is a required field'}
+                    for field in missing)
+            elif row['email'].lower() in seen:
+                report['conflicts'].append(
+                    {'row': row_number, 'email': row['email'],
+                     'message': 'Duplicate email in import'})
+            else:
+                seen.add(row['email'].lower())
+                valid.append((row_number, row))
+
+        hashes = hasher.hash_many([row['password'] for _, row in valid])
+        users = [{
+            'userId': str(uuid4()),
+            'firstName': row['firstName'],
+            'lastName': row['lastName'],
+            'email': row['email'],
+            'password': password,
+            'phone': row.get('phone') or None,
+        } for (_, row), password in zip(valid, hashes)]
+
+        created = storage.create_users(users)
+        report['created'] += len(created)
+        report['conflicts'].extend(
+            {'row': row_number, 'email': row['email'],
+             'message': 'User already exist'}
+            for row_number, row in valid if row['email'] not in created)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        sys.exit(__doc__.rstrip().rsplit('\n', 1)[-1])
+    from db import storage
+    path = sys.argv[1]
+    fmt = 'csv' if path.endswith('.csv') else 'ndjson'
+    batch_size = int(sys.argv[2]) if len(sys.argv) == 3 else 500
+    with open(path, newline='', encoding='utf-8') as f:
+        try:
+            result = import_users(storage, read_rows(f, fmt), batch_size)
+        except UnreadableInput as e:
+            result = e.report
+    storage.close()
+    print(json.dumps(result, indent=2))
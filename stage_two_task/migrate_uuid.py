@@ -0,0 +1,110 @@
+"""
+convert a database created with string user and organisation ids to the
+native uuid key columns and add the supporting indexes; safe to re-run
+
+usage: python migrate_uuid.py [database_url]
+"""
+import os
+import sys
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.schema import CreateIndex
+
+# run as a script, models still needs the common package at the root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Base, user_organizations  # noqa: E402
+
+# (table, column) pairs holding user or organisation ids
+KEY_COLUMNS = [
+    ('users', 'userId'),
+    ('organizations', 'orgId'),
+    ('user_organizations', 'user_id'),
+    ('user_organizations', 'organization_id'),
+]
+FOREIGN_KEYS = {
+    'user_id': ('users', 'userId'),
+    'organization_id': ('organizations', 'orgId'),
+}
+
+
+def migrate_postgresql(conn):
+    """ retype the key columns to uuid, re-creating the foreign keys """
+    pending = [(table, column) for table, column in KEY_COLUMNS
+               if conn.execute(text(
+                   'SELECT data_type FROM information_schema.columns '
+                   'WHERE table_name = :table AND column_name = :column'),
+                   {'table': table, 'column': column}).scalar() != 'uuid']
+    if not pending:
+        return []
+
+    # the referencing and referenced columns must change type together
+    foreign_keys = inspect(conn).get_foreign_keys('user_organizations')
+    for fk in foreign_keys:
+        conn.execute(text(
+            f'ALTER TABLE user_organizations DROP CONSTRAINT "{fk["name"]}"'))
+    for table, column in pending:
+        conn.execute(text(
+            f'ALTER TABLE {table} ALTER COLUMN "{column}" '
+            f'TYPE uuid USING "{column}"::uuid'))
+    for column, (table, referenced) in FOREIGN_KEYS.items():
+        conn.execute(text(
+            f'ALTER TABLE user_organizations ADD CONSTRAINT '
+            f'user_organizations_{column}_fkey FOREIGN KEY ({column}) '
+            f'REFERENCES {table} ("{referenced}")'))
+    return pending
+
+
+def migrate_sqlite(conn):
+    """ rewrite ids to the 32 hex digit form uuid columns use on SQLite """
+    pending = []
+    for table, column in KEY_COLUMNS:
+        result = conn.execute(text(
+            f'UPDATE {table} SET "{column}" = '
+            f'lower(replace("{column}", \'-\', \'\')) '
+            f'WHERE "{column}" LIKE \'%-%\''))
+        if result.rowcount:
+            pending.append((table, column))
+    return pending
+
+
+MIGRATIONS = {
+    'postgresql': migrate_postgresql,
+    'sqlite': migrate_sqlite,
+}
+
+
+def migrate(engine):
+    """
+    migrate the key columns in one transaction and create any missing
+    index, returns the (table, column) pairs that were converted; raises
+    ValueError, changing nothing, if emails differ only in case
+    """
+    migration = MIGRATIONS.get(engine.dialect.name)
+    if migration is None:
+        raise ValueError(f'unsupported database {engine.dialect.name}')
+    with engine.begin() as conn:
+        # the email index is unique ignoring case; resolve these by hand
+        clashes = conn.execute(text(
+            'SELECT lower(email) FROM users GROUP BY lower(email) '
+            'HAVING count(*) > 1')).scalars().all()
+        if clashes:
+            raise ValueError('emails registered more than once in different '
+                             'case: ' + ', '.join(sorted(clashes)))
+        converted = migration(conn)
+        for table in (user_organizations, Base.metadata.tables['users']):
+            for index in table.indexes:
+                # reflection can't see expression indexes, so checkfirst can't
+                conn.execute(CreateIndex(index, if_not_exists=True))
+    return converted
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        sys.exit(__doc__.rstrip().rsplit('\n', 1)[-1])
+    if len(sys.argv) == 2:
+        engine = create_engine(sys.argv[1])
+    else:
+        from db import storage
+        engine = storage.engines[0]
+    for table, column in migrate(engine):
+        print(f'converted {table}.{column}')
@@ -1,27 +1,58 @@
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, String, ForeignKey, Table
-from uuid import uuid4
-import bcrypt
+from sqlalchemy import (
+    Column, String, ForeignKey, Table, Index, TypeDecorator, Uuid, func
+)
+from uuid import uuid4, UUID
+from hashing import hasher
 
 
 # Define the Base class
 Base = declarative_base()
 
 
+def uuid_str(value):
+    """ canonical form of a uuid string, None if value is not one """
+    try:
+        return str(UUID(value))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class UUIDString(TypeDecorator):
+    """
+    uuid key stored natively (16 bytes on Postgres) but read and written
+    as its canonical string, so ids stay strings in the API and in JWTs.
+    Binding a string that is not a uuid raises StatementError
+    """
+    impl = Uuid(as_uuid=False)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        uuid = uuid_str(value)
+        if uuid is None:
+            raise ValueError(f'{value!r} is not a uuid')
+        return uuid
+
+
 # many to many relationship association table between organization and users
 user_organizations = Table('user_organizations', Base.metadata,
-                           Column('user_id', String, ForeignKey(
+                           Column('user_id', UUIDString, ForeignKey(
                                'users.userId'), primary_key=True, nullable=False),
-                           Column('organization_id', String, ForeignKey(
+                           Column('organization_id', UUIDString, ForeignKey(
                                'organizations.orgId'), primary_key=True, nullable=False)
                            )
+# the primary key serves user -> organisations, this serves the reverse
+Index('ix_user_organizations_organization_id',
+      user_organizations.c.organization_id, user_organizations.c.user_id)
 
 
 # user class
 class User(Base):
     __tablename__ = 'users'
 
-    userId = Column(String, primary_key=True, nullable=False, unique=True)
+    userId = Column(UUIDString, primary_key=True, nullable=False, unique=True)
     firstName = Column(String, nullable=False)
     lastName = Column(String, nullable=False)
     email = Column(String, nullable=False, unique=True)
@@ -38,8 +69,7 @@ class User(Base):
             if 'userId' not in kwargs:
                 self.userId = str(uuid4())
             if 'password' in kwargs:
-                self.password = bcrypt.hashpw(kwargs['password'].encode(
-                    'utf-8'), bcrypt.gensalt()).decode('utf-8')
+                self.password = hasher.hash(kwargs['password'])
 
     def __repr__(self):
         return f"<User(name='{self.name}', age={self.age})>"
@@ -71,13 +101,17 @@ class User(Base):
         validates password
         """
         if isinstance(password_string, str):
-            return bcrypt.checkpw(password_string.encode('utf-8'), self.password.encode('utf8'))
+            return hasher.verify(password_string, self.password)
+
+
+# emails are unique and looked up ignoring case
+Index('ix_users_email_lower', func.lower(User.email), unique=True)
 
 
 class Organization(Base):
     __tablename__ = 'organizations'
 
-    orgId = Column(String, primary_key=True, unique=True)
+    orgId = Column(UUIDString, primary_key=True, unique=True)
     name = Column(String, nullable=False)
     description = Column(String)
 
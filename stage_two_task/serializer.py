@@ -0,0 +1,35 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson; output matches the default
+    provider's compact, key-sorted form
+    """
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps(obj) + b'\n',
+                                         mimetype=self.mimetype)
+
+    def _dumps(self, obj):
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_SORT_KEYS
+                            | orjson.OPT_NON_STR_KEYS)
+
+
+def init_json(app):
+    """ use orjson for request and response bodies when it is installed """
+    if orjson is not None:
+        app.json = ORJSONProvider(app)
@@ -0,0 +1,128 @@
+import pytest
+
+
+def register(client, email, **fields):
+    response = client.post('/auth/register', json={
+        'firstName': 'John', 'lastName': 'Doe', 'email': email,
+        'password': 'password123', **fields})
+    return response
+
+
+def auth_header(response):
+    return {'Authorization': f"Bearer {response.json['data']['accessToken']}"}
+
+
+def test_import_is_for_operators_only(client, monkeypatch):
+    response = register(client, 'import-user@example.com')
+    user_id = response.json['data']['user']['userId']
+    headers = {**auth_header(response), 'Content-Type': 'text/csv'}
+    body = ('firstName,lastName,email,password\n'
+            'Jane,Doe,imported@example.com,password123\n')
+
+    response = client.post('/api/users/import', data=body, headers=headers)
+    assert response.status_code == 403
+
+    monkeypatch.setattr('app.ADMIN_USER_IDS', frozenset({user_id}))
+    response = client.post('/api/users/import', data=body, headers=headers)
+    assert response.json['data']['created'] == 1
+
+
+@pytest.mark.parametrize('bad_row', [
+    # not utf-8, past the first decoded chunk of the body
+    b'Bad,Bytes,\xff\xfe@x.com,password123\n',
+    # a field over the csv module's size limit
+    b'Big,Field,big@x.com,"' + b'x' * 200000 + b'"\n',
+])
+def test_import_reports_an_unreadable_body(client, monkeypatch, bad_row):
+    response = register(client, f'unreadable-{len(bad_row)}@example.com')
+    user_id = response.json['data']['user']['userId']
+    headers = {**auth_header(response), 'Content-Type': 'text/csv'}
+    monkeypatch.setattr('app.ADMIN_USER_IDS', frozenset({user_id}))
+    rows = [f'Jane,Doe,unreadable-{len(bad_row)}-{i}@x.com,password123\n'
+            for i in range(300)]
+    body = ('firstName,lastName,email,password\n' + ''.join(rows)).encode()
+
+    response = client.post('/api/users/import', data=body + bad_row,
+                           headers=headers)
+    assert response.status_code == 422
+    report = response.json['data']
+    assert report['created'] > 0
+    assert report['errors'][-1]['row'] == report['created'] + 1
+    assert report['errors'][-1]['message'].startswith('Row could not be read')
+
+
+def test_register_conflicts(client):
+    assert register(client, 'taken@example.com').status_code == 201
+
+    response = register(client, 'taken@example.com')
+    assert response.status_code == 422
+    assert response.json['message'] == 'User already exist'
+
+    # other constraint violations are not a duplicate user
+    response = register(client, 'nameless@example.com', firstName=None)
+    assert response.status_code == 400
+
+
+def test_emails_are_unique_ignoring_case(client):
+    response = register(client, 'case@example.com')
+    user_id = response.json['data']['user']['userId']
+
+    response = register(client, 'Case@Example.com')
+    assert response.status_code == 422
+    assert response.json['message'] == 'User already exist'
+
+    response = client.post('/auth/login', json={
+        'email': 'CASE@example.COM', 'password': 'password123'})
+    assert response.status_code == 200
+    assert response.json['data']['user']['userId'] == user_id
+
+
+def test_busy_hasher_returns_503(client, monkeypatch):
+    from hashing import HasherBusy
+
+    def busy(*args):
+        raise HasherBusy('password hashing queue is full')
+
+    monkeypatch.setattr('hashing.hasher.hash', busy)
+    response = register(client, 'busy@example.com')
+    assert response.status_code == 503
+    assert response.json['statusCode'] == 503
+
+
+def test_login_rehashes_with_new_rounds(client, monkeypatch):
+    from db import storage
+    register(client, 'rehash@example.com')
+
+    def stored_rounds():
+        user = storage.get_user_by_email('rehash@example.com')
+        storage.close()
+        return int(user.password.split('$')[2])
+
+    assert stored_rounds() == 4
+    monkeypatch.setattr('hashing.hasher.rounds', 5)
+    response = client.post('/auth/login', json={
+        'email': 'rehash@example.com', 'password': 'password123'})
+    assert response.status_code == 200
+    assert stored_rounds() == 5
+
+
+def test_login_skips_rehash_when_hasher_is_busy(client, monkeypatch):
+    from db import storage
+    from hashing import HasherBusy
+    register(client, 'busy-rehash@example.com')
+
+    def busy(*args):
+        raise HasherBusy('password hashing queue is full')
+
+    monkeypatch.setattr('hashing.hasher.rounds', 5)
+    monkeypatch.setattr('hashing.hasher.hash', busy)
+    response = client.post('/auth/login', json={
+        'email': 'busy-rehash@example.com', 'password': 'password123'})
+    assert response.status_code == 200
+    user = storage.get_user_by_email('busy-rehash@example.com')
+    storage.close()
+    assert user.password.split('$')[2] == '04'
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,85 @@
+import asyncio, os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aio_db import AsyncDatabase  # noqa: E402
+from models import User, Organization  # noqa: E402
+
+
+@pytest.fixture
+def run(tmp_path):
+    """ run a coroutine against a fresh SQLite database """
+    def runner(scenario):
+        async def main():
+            storage = AsyncDatabase(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+            await storage.reload()
+            try:
+                return await scenario(storage)
+            finally:
+                await storage.close()
+                await storage.dispose()
+        return asyncio.run(main())
+    return runner
+
+
+def new_user(email):
+    user = User(firstName='John', lastName='Doe', email=email,
+                password='password123')
+    user.organizations.append(Organization(name="John's Organisation"))
+    return user
+
+
+def test_save_and_get_one(run):
+    async def scenario(storage):
+        user = new_user('john@example.com')
+        await storage.save(user)
+        found = await storage.get_one(obj='user',
+                                      filter={'email': 'john@example.com'})
+        org = await storage.get_one(obj='org',
+                                    filter={'name': "John's Organisation"})
+        return user, found, org
+
+    user, found, org = run(scenario)
+    assert found.userId == user.userId
+    assert found.check_password('password123')
+    assert org is not None
+
+
+def test_get_one_missing(run):
+    async def scenario(storage):
+        return await storage.get_one(obj='user', filter={'userId': 'nope'})
+
+    assert run(scenario) is None
+
+
+def test_duplicate_email_rolls_back(run):
+    async def scenario(storage):
+        await storage.save(new_user('jane@example.com'))
+        with pytest.raises(Exception):
+            await storage.save(new_user('jane@example.com'))
+        # the session is still usable after the failed commit
+        return await storage.get_one(obj='user',
+                                     filter={'email': 'jane@example.com'})
+
+    assert run(scenario) is not None
+
+
+def test_sessions_are_per_task(run):
+    async def scenario(storage):
+        await storage.save(new_user('task@example.com'))
+
+        async def lookup():
+            try:
+                return await storage.get_one(
+                    obj='user', filter={'email': 'task@example.com'})
+            finally:
+                await storage.close()
+
+        return await asyncio.gather(*[lookup() for _ in range(10)])
+
+    assert all(user is not None for user in run(scenario))
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,203 @@
+"""
+in-process throughput and latency benchmark for the stage_two_task API
+
+Boots the app against a local database (a temporary SQLite file unless
+--db-url is given), seeds users, a large organisation and a user who
+belongs to many organisations, then drives each endpoint from
+--concurrency threads and prints per-endpoint throughput and latency
+percentiles as JSON, suitable for diffing between releases.
+
+usage: python tests/benchmark.py [--users N] [--requests N] [--output FILE]
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import count
+from time import perf_counter
+from uuid import uuid4
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+
+STAGE_TWO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'password123'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db-url', help='SQLAlchemy URL of the database '
+                        'to run against (default: temporary SQLite file)')
+    parser.add_argument('--users', type=int, default=2000,
+                        help='users to seed')
+    parser.add_argument('--power-user-orgs', type=int, default=300,
+                        help='organisations the power user belongs to')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='client threads per endpoint')
+    parser.add_argument('--bcrypt-rounds', type=int,
+                        help='override the bcrypt cost used by /auth/login')
+    parser.add_argument('--output', help='write the JSON report here too')
+    return parser.parse_args(argv)
+
+
+def percentile(ordered, fraction):
+    """ nearest-rank percentile of an ascending list """
+    if not ordered:
+        return None
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[index]
+
+
+def seed(storage, hasher, users, power_user_orgs):
+    """ create the benchmark data set, returning ids the scenarios use """
+    password = hasher.hash(PASSWORD)
+    rows = [{
+        'userId': str(uuid4()),
+        'firstName': f'User{i}',
+        'lastName': 'Bench',
+        'email': f'bench-{i}-{uuid4().hex[:8]}@example.com',
+        'password': password,
+        'phone': None,
+    } for i in range(users)]
+    for start in range(0, len(rows), 500):
+        storage.create_users(rows[start:start + 500])
+
+    user_ids = [row['userId'] for row in rows]
+    power_user = rows[0]
+    org_of = {}
+    for user_id in user_ids[:power_user_orgs + 1]:
+        org_of[user_id] = storage.get_user_organisations(user_id, 1)[0].orgId
+
+    # the power user joins the default organisation of many others
+    for user_id in user_ids[1:power_user_orgs + 1]:
+        storage.add_members(org_of[user_id], [power_user['userId']])
+    # and every user joins the power user's organisation
+    large_org = org_of[power_user['userId']]
+    storage.add_members(large_org, user_ids)
+    storage.close()
+
+    return {
+        'power_user': power_user,
+        'large_org': large_org,
+        'user_ids': user_ids,
+        'joinable_orgs': [org_of[user_id]
+                          for user_id in user_ids[1:power_user_orgs + 1]],
+    }
+
+
+def run_scenario(app, make_request, requests, concurrency):
+    """ issue requests calls of make_request(client, n) and time each """
+    counter = count()
+    latencies = []
+    errors = 0
+
+    def worker():
+        client = app.test_client()
+        local, failed = [], 0
+        while True:
+            n = next(counter)
+            if n >= requests:
+                break
+            start = perf_counter()
+            response = make_request(client, n)
+            local.append(perf_counter() - start)
+            if response.status_code >= 500:
+                failed += 1
+        return local, failed
+
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            local, failed = future.result()
+            latencies.extend(local)
+            errors += failed
+    elapsed = perf_counter() - started
+
+    latencies.sort()
+    ms = 1000.0
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * ms, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * ms, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * ms, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * ms, 3),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.db_url:
+        os.environ['db_url'] = args.db_url
+    else:
+        db_dir = tempfile.mkdtemp(prefix='hng-bench-')
+        os.environ['db_url'] = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    if args.bcrypt_rounds:
+        os.environ['bcrypt_rounds'] = str(args.bcrypt_rounds)
+    os.environ.setdefault('jwtSecretKey', 'benchmark-secret-key-long-enough')
+    sys.path.insert(0, STAGE_TWO_DIR)
+
+    from flask_jwt_extended import create_access_token
+    from app import app
+    from db import storage
+    from hashing import hasher
+    app.config['DEBUG'] = False
+
+    data = seed(storage, hasher, args.users, args.power_user_orgs)
+    power_user = data['power_user']
+    user_ids = data['user_ids']
+    with app.app_context():
+        token = create_access_token(identity=power_user['userId'])
+    headers = {'Authorization': f'Bearer {token}'}
+    joinable = data['joinable_orgs']
+
+    scenarios = {
+        'POST /auth/login': lambda client, n: client.post(
+            '/auth/login',
+            json={'email': power_user['email'], 'password': PASSWORD}),
+        'GET /api/users/<id>': lambda client, n: client.get(
+            f'/api/users/{user_ids[n % len(user_ids)]}', headers=headers),
+        'GET /api/organisations': lambda client, n: client.get(
+            '/api/organisations', headers=headers),
+        'GET /api/organisations/<orgId>': lambda client, n: client.get(
+            f'/api/organisations/{joinable[n % len(joinable)]}',
+            headers=headers),
+        'POST /api/organisations/<orgId>/users': lambda client, n: client.post(
+            f'/api/organisations/{joinable[n % len(joinable)]}/users',
+            json={'userId': user_ids[-1 - n % len(user_ids)]}),
+    }
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': os.environ['db_url'].split(':', 1)[0],
+            'users': args.users,
+            'power_user_orgs': args.power_user_orgs,
+            'large_org_members': len(user_ids),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'bcrypt_rounds': hasher.rounds,
+        },
+        'endpoints': {
+            name: run_scenario(app, make_request, args.requests,
+                               args.concurrency)
+            for name, make_request in scenarios.items()
+        },
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
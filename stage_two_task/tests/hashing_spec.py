@@ -0,0 +1,68 @@
+import os, sys, threading, time
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hashing import PasswordHasher, HasherBusy  # noqa: E402
+
+
+def free_slots(hasher):
+    """ number of hashing slots not currently held """
+    taken = 0
+    while hasher._slots.acquire(blocking=False):
+        taken += 1
+    for _ in range(taken):
+        hasher._slots.release()
+    return taken
+
+
+def test_hash_many_releases_slots_when_submit_fails(monkeypatch):
+    hasher = PasswordHasher(rounds=4, workers=2, max_queue=2)
+    before = free_slots(hasher)
+
+    def submit(*args):
+        raise RuntimeError('executor shut down')
+
+    monkeypatch.setattr(hasher._executor, 'submit', submit)
+    with pytest.raises(RuntimeError):
+        hasher.hash_many(['a', 'b'])
+    assert free_slots(hasher) == before
+
+
+def test_full_queue_fails_fast(monkeypatch):
+    hasher = PasswordHasher(rounds=4, workers=1, max_queue=1)
+    release = threading.Event()
+    real_hash = hasher._hash
+
+    def slow_hash(password):
+        release.wait(timeout=5)
+        return real_hash(password)
+
+    monkeypatch.setattr(hasher, '_hash', slow_hash)
+    # one hash running and one queued fill the pool
+    busy = [threading.Thread(target=hasher.hash, args=('x',))
+            for _ in range(2)]
+    for thread in busy:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while free_slots(hasher) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    with pytest.raises(HasherBusy):
+        hasher.hash('one too many')
+    release.set()
+    for thread in busy:
+        thread.join(timeout=5)
+    assert free_slots(hasher) == 2
+    assert hasher.verify('y', hasher.hash('y'))
+
+
+def test_needs_rehash_follows_configured_rounds():
+    hashed = PasswordHasher(rounds=4).hash('secret')
+    assert not PasswordHasher(rounds=4).needs_rehash(hashed)
+    assert PasswordHasher(rounds=5).needs_rehash(hashed)
+    assert PasswordHasher(rounds=4).needs_rehash('not a bcrypt hash')
+
+
+if __name__ == '__main__':
+    pytest.main()
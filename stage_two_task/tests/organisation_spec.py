@@ -0,0 +1,97 @@
+import pytest
+
+
+def register(client, email):
+    response = client.post('/auth/register', json={
+        'firstName': 'John', 'lastName': 'Doe', 'email': email,
+        'password': 'password123'})
+    assert response.status_code == 201
+    data = response.json['data']
+    return data['user']['userId'], {
+        'Authorization': f"Bearer {data['accessToken']}"}
+
+
+def organisations(client, headers, **params):
+    response = client.get('/api/organisations', headers=headers,
+                          query_string=params)
+    return response
+
+
+def test_bulk_add_requires_membership(client):
+    _, owner = register(client, 'bulk-owner@example.com')
+    outsider_id, outsider = register(client, 'bulk-outsider@example.com')
+    org_id = organisations(client, owner).json[
+        'data']['organisations'][0]['orgId']
+
+    response = client.post(f'/api/organisations/{org_id}/users/bulk',
+                           json={'userIds': [outsider_id]}, headers=outsider)
+    assert response.status_code == 403
+    assert client.get(f'/api/organisations/{org_id}',
+                      headers=outsider).status_code == 403
+
+    response = client.post(f'/api/organisations/{org_id}/users/bulk',
+                           json={'userIds': [outsider_id]}, headers=owner)
+    assert response.json['data']['results'] == [
+        {'userId': outsider_id, 'status': 'added'}]
+
+
+def test_bulk_add_counts_each_user_once(client):
+    _, owner = register(client, 'spelling-owner@example.com')
+    user_id, _ = register(client, 'spelling-user@example.com')
+    org_id = organisations(client, owner).json[
+        'data']['organisations'][0]['orgId']
+
+    response = client.post(f'/api/organisations/{org_id}/users/bulk',
+                           json={'userIds': [user_id, user_id.upper()]},
+                           headers=owner)
+    assert response.json['data']['results'] == [
+        {'userId': user_id, 'status': 'added'},
+        {'userId': user_id.upper(), 'status': 'already member'}]
+
+
+def test_pages_follow_next_cursor(client):
+    _, headers = register(client, 'pages@example.com')
+    for i in range(6):
+        response = client.post('/api/organisations', headers=headers,
+                               json={'name': f'Page Org {i}'})
+        assert response.status_code == 201
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {'limit': 3, **({'cursor': cursor} if cursor else {})}
+        response = organisations(client, headers, **params)
+        assert response.status_code == 200
+        data = response.json['data']
+        assert len(data['organisations']) <= 3
+        seen.extend(org['orgId'] for org in data['organisations'])
+        pages += 1
+        cursor = data['nextCursor']
+        if cursor is None:
+            break
+
+    # the default organisation plus six, each exactly once, in key order
+    assert pages == 3
+    assert len(seen) == len(set(seen)) == 7
+    assert seen == sorted(seen)
+    everything = organisations(client, headers).json['data']
+    assert [org['orgId'] for org in everything['organisations']] == seen
+    assert everything['nextCursor'] is None
+
+
+@pytest.mark.parametrize('params, field', [
+    ({'limit': 0}, 'limit'),
+    ({'limit': 'ten'}, 'limit'),
+    ({'limit': 100000}, 'limit'),
+    ({'cursor': '!!not-base64!!'}, 'cursor'),
+    # base64 of "not-a-uuid"
+    ({'cursor': 'bm90LWEtdXVpZA'}, 'cursor'),
+])
+def test_bad_page_parameters(client, request, params, field):
+    _, headers = register(client, f'{request.node.callspec.id}@example.com')
+    response = organisations(client, headers, **params)
+    assert response.status_code == 422
+    assert response.json['errors'][0]['field'] == field
+
+
+if __name__ == '__main__':
+    pytest.main()
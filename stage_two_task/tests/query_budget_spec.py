@@ -0,0 +1,125 @@
+import pytest
+
+# most SQL statements a request to each route may run; requests are
+# measured with cold caches, so these are upper bounds
+QUERY_BUDGETS = {
+    ('POST', '/auth/register'): 3,
+    ('POST', '/auth/login'): 2,
+    ('GET', '/api/users/<string:id>'): 3,
+    ('GET', '/api/organisations'): 3,
+    ('GET', '/api/organisations/<string:orgId>'): 3,
+    ('POST', '/api/organisations'): 4,
+    ('POST', '/api/organisations/<string:orgId>/users'): 3,
+    ('POST', '/api/organisations/<string:orgId>/users/bulk'): 4,
+    ('POST', '/api/users/import'): 3,
+}
+
+
+@pytest.fixture
+def api(app, client, queries):
+    """
+    test client that fails a request running more SQL statements than
+    its route's budget
+    """
+    from app import principals
+    adapter = app.url_map.bind('localhost')
+
+    def call(method, path, **kwargs):
+        rule, _ = adapter.match(path.split('?')[0], method=method,
+                                return_rule=True)
+        budget = QUERY_BUDGETS[(method, rule.rule)]
+        principals.clear()
+        queries.reset()
+        response = client.open(path, method=method, **kwargs)
+        assert queries.count <= budget, (
+            f'{method} {rule.rule} ran {queries.count} queries, budget is '
+            f'{budget}:\n' + '\n'.join(queries.statements))
+        return response
+    return call
+
+
+def register(api, email):
+    response = api('POST', '/auth/register', json={
+        'firstName': 'John', 'lastName': 'Doe', 'email': email,
+        'password': 'password123'})
+    assert response.status_code == 201
+    data = response.json['data']
+    return data['user']['userId'], {
+        'Authorization': f"Bearer {data['accessToken']}"}
+
+
+def first_org_id(api, headers):
+    response = api('GET', '/api/organisations', headers=headers)
+    assert response.status_code == 200
+    return response.json['data']['organisations'][0]['orgId']
+
+
+def test_auth_budgets(api):
+    register(api, 'budget-auth@example.com')
+    response = api('POST', '/auth/login', json={
+        'email': 'budget-auth@example.com', 'password': 'password123'})
+    assert response.status_code == 200
+
+
+def test_organisation_budgets(api):
+    user_id, headers = register(api, 'budget-org@example.com')
+    for i in range(5):
+        response = api('POST', '/api/organisations',
+                       json={'name': f'Org {i}'}, headers=headers)
+        assert response.status_code == 201
+    org_id = first_org_id(api, headers)
+    assert api('GET', f'/api/organisations/{org_id}',
+               headers=headers).status_code == 200
+    assert api('GET', f'/api/users/{user_id}',
+               headers=headers).status_code == 200
+
+
+def test_warm_principal_skips_the_user_lookup(api, client, queries):
+    from app import principals
+    user_id, headers = register(api, 'budget-warm@example.com')
+    counts = []
+    for _ in range(2):
+        queries.reset()
+        response = client.get('/api/organisations', headers=headers)
+        assert response.status_code == 200
+        counts.append(queries.count)
+    assert principals.peek(user_id).userId == user_id
+    assert counts[1] == counts[0] - 1
+    assert not any('FROM users' in statement
+                   for statement in queries.statements)
+
+
+def test_membership_budgets(api):
+    _, headers = register(api, 'budget-owner@example.com')
+    other_id, _ = register(api, 'budget-member@example.com')
+    org_id = first_org_id(api, headers)
+    response = api('POST', f'/api/organisations/{org_id}/users',
+                   json={'userId': other_id})
+    assert response.status_code == 200
+    assert api('GET', f'/api/users/{other_id}',
+               headers=headers).status_code == 200
+
+
+def test_bulk_budgets_do_not_grow_with_input(api, monkeypatch):
+    admin_id, headers = register(api, 'budget-bulk@example.com')
+    monkeypatch.setattr('app.ADMIN_USER_IDS', frozenset({admin_id}))
+    rows = ''.join(f'Bulk{i},Doe,budget-bulk-{i}@example.com,password{i}\n'
+                   for i in range(50))
+    response = api('POST', '/api/users/import',
+                   data='firstName,lastName,email,password\n' + rows,
+                   headers={**headers, 'Content-Type': 'text/csv'})
+    assert response.json['data']['created'] == 50
+
+    from db import storage
+    user_ids = [storage.get_view(obj='user', filter={
+        'email': f'budget-bulk-{i}@example.com'}).userId for i in range(50)]
+    storage.close()
+    org_id = first_org_id(api, headers)
+    response = api('POST', f'/api/organisations/{org_id}/users/bulk',
+                   json={'userIds': user_ids + ['missing']}, headers=headers)
+    statuses = [r['status'] for r in response.json['data']['results']]
+    assert statuses == ['added'] * 50 + ['not found']
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,87 @@
+from uuid import uuid4
+from sqlalchemy import create_engine
+from sqlalchemy.orm import object_session
+import pytest
+
+
+@pytest.fixture
+def storage(Database, tmp_path):
+    """
+    storage on a primary SQLite file with a second file as its replica,
+    both seeded with the same user and organisation; the replica's copy
+    of the user has a different last name, telling the two apart
+    """
+    from models import Base, User, Organization, user_organizations
+    user_id, org_id, other_org_id = str(uuid4()), str(uuid4()), str(uuid4())
+    urls = [f"sqlite:///{tmp_path / name}" for name in ('primary.db',
+                                                        'replica.db')]
+    for url, last_name in zip(urls, ('Primary', 'Replica')):
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(User.__table__.insert().values(
+                userId=user_id, firstName='John', lastName=last_name,
+                email='john@example.com', password='x'))
+            conn.execute(Organization.__table__.insert().values([
+                {'orgId': org_id, 'name': "John's Organisation"},
+                {'orgId': other_org_id, 'name': 'Other Organisation'}]))
+            conn.execute(user_organizations.insert().values(
+                user_id=user_id, organization_id=org_id))
+        engine.dispose()
+
+    storage = Database(urls[0], replica_urls=urls[1:])
+    storage.reload()
+    storage.user_id, storage.org_id = user_id, org_id
+    storage.other_org_id = other_org_id
+    yield storage
+    storage.close()
+
+
+def last_name(storage):
+    return storage.get_view(obj='user',
+                            filter={'userId': storage.user_id}).lastName
+
+
+def test_reads_go_to_the_replica(storage):
+    assert last_name(storage) == 'Replica'
+    assert storage.get_one(obj='user', filter={
+        'userId': storage.user_id}).lastName == 'Replica'
+
+
+def test_writes_pin_reads_to_the_primary_until_close(storage):
+    from models import Organization
+    user = storage.get_one(obj='user', filter={'userId': storage.user_id})
+    user.organizations.append(Organization(name='Second'))
+    storage.save(user)
+    # read-your-writes for the rest of the request
+    assert last_name(storage) == 'Primary'
+    assert len(storage.get_user_organisations(storage.user_id, 10)) == 2
+
+    storage.close()
+    assert last_name(storage) == 'Replica'
+    assert len(storage.get_user_organisations(storage.user_id, 10)) == 1
+
+
+def test_membership_writes_pin_too(storage):
+    assert storage.add_members(storage.other_org_id, [storage.user_id]) == {
+        storage.user_id: 'added'}
+    assert last_name(storage) == 'Primary'
+    assert storage.is_member(storage.user_id, storage.other_org_id)
+
+
+def test_save_keeps_unrelated_replica_objects_loaded(storage):
+    from models import Organization
+    other = storage.get_one(obj='org', filter={'orgId': storage.other_org_id})
+    user = storage.get_one(obj='user', filter={'userId': storage.user_id})
+    user.organizations.append(Organization(name='Second'))
+    storage.save(user)
+
+    # other is not reachable from user, so it stays loaded in the replica
+    # session while user moved to the primary
+    assert object_session(other) is not None
+    assert object_session(other) is not object_session(user)
+    assert other.name == 'Other Organisation'
+
+
+if __name__ == '__main__':
+    pytest.main()